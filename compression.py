@@ -0,0 +1,212 @@
+"""
+Module that contains ResponseCompressor class
+"""
+import logging
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class ResponseCompressor():
+    """
+    Compress responses of a Flask app with an encoding that client accepts:
+    brotli or zstd (if their modules are installed) or gzip.
+    Responses smaller than min_size bytes are not compressed, streamed
+    responses are compressed chunk by chunk
+    """
+
+    COMPRESSIBLE_MIMETYPES = {'application/json',
+                              'application/x-ndjson',
+                              'application/javascript',
+                              'text/html',
+                              'text/plain',
+                              'text/css',
+                              'text/markdown'}
+
+    def __init__(self, min_size=1024, gzip_level=6, brotli_quality=5, zstd_level=3):
+        self.logger = logging.getLogger('logger')
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.zstd_level = zstd_level
+        # Supported encodings in order of preference
+        self.encodings = []
+        if brotli is not None:
+            self.encodings.append('br')
+
+        if zstandard is not None:
+            self.encodings.append('zstd')
+
+        self.encodings.append('gzip')
+
+    def init_app(self, app):
+        """
+        Compress all responses of the app
+        """
+        app.after_request(self.compress_response)
+        self.logger.info('Response compression: %s', ', '.join(self.encodings))
+
+    def get_compressor(self, encoding):
+        """
+        Return a new object with compress(bytes), sync_flush() and flush() methods
+        """
+        if encoding == 'br':
+            return BrotliCompressor(self.brotli_quality)
+
+        if encoding == 'zstd':
+            return ZstdCompressor(self.zstd_level)
+
+        return GzipCompressor(self.gzip_level)
+
+    def compress_response(self, response):
+        """
+        Compress response if client accepts one of supported encodings
+        Range responses are not compressed, because ranges describe uncompressed bytes
+        """
+        if (request.method == 'HEAD'
+                or response.status_code < 200
+                or response.status_code in (204, 206, 304)
+                or 'Content-Range' in response.headers
+                or 'Accept-Ranges' in response.headers
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in self.COMPRESSIBLE_MIMETYPES):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if not encoding:
+            return response
+
+        streamed = response.is_streamed
+        if not streamed and response.content_length is not None and response.content_length < self.min_size:
+            return response
+
+        compressor = self.get_compressor(encoding)
+        if streamed:
+            response.response = self.compress_chunks(response.response, compressor)
+            response.headers.pop('Content-Length', None)
+        else:
+            response.direct_passthrough = False
+            response.set_data(compressor.compress(response.get_data()) + compressor.flush())
+
+        response.headers['Content-Encoding'] = encoding
+        # Compressed content is not byte-for-byte the same as the original
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+
+        return response
+
+    @staticmethod
+    def compress_chunks(chunks, compressor):
+        """
+        Yield compressed chunks of a streamed response. Every chunk is flushed,
+        so client can decompress it right away
+        """
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+
+                if not chunk:
+                    continue
+
+                compressed = compressor.compress(chunk) + compressor.sync_flush()
+                if compressed:
+                    yield compressed
+
+            yield compressor.flush()
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+
+class GzipCompressor():
+    """
+    Gzip compressor
+    """
+
+    def __init__(self, level):
+        # 16 + MAX_WBITS makes gzip header and trailer
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        """
+        Compress a chunk of data
+        """
+        return self.compressor.compress(data)
+
+    def sync_flush(self):
+        """
+        Return all data compressed so far without ending the stream
+        """
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def flush(self):
+        """
+        Return remaining compressed data and end the stream
+        """
+        return self.compressor.flush()
+
+
+class BrotliCompressor():
+    """
+    Brotli compressor with the same interface as GzipCompressor
+    """
+
+    def __init__(self, quality):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        """
+        Compress a chunk of data
+        """
+        return self.compressor.process(data)
+
+    def sync_flush(self):
+        """
+        Return all data compressed so far without ending the stream
+        """
+        return self.compressor.flush()
+
+    def flush(self):
+        """
+        Return remaining compressed data and end the stream
+        """
+        return self.compressor.finish()
+
+
+class ZstdCompressor():
+    """
+    Zstandard compressor with the same interface as GzipCompressor
+    """
+
+    def __init__(self, level):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        """
+        Compress a chunk of data
+        """
+        return self.compressor.compress(data)
+
+    def sync_flush(self):
+        """
+        Return all data compressed so far without ending the stream
+        """
+        return self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def flush(self):
+        """
+        Return remaining compressed data and end the stream
+        """
+        return self.compressor.flush()
@@ -6,23 +6,59 @@ import logging
 import os
 import json
 import time
+import select
 import ssl
+import threading
 from contextlib import contextmanager
 
 
+class ResumingHTTPSConnection(client.HTTPSConnection):
+    """
+    HTTPS connection that resumes TLS session of previous connection
+    to the same host instead of doing a full handshake
+    """
+
+    def __init__(self, *args, session_holder=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session_holder = session_holder
+
+    def connect(self):
+        client.HTTPConnection.connect(self)
+        server_hostname = self._tunnel_host or self.host
+        session = self.session_holder.tls_session if self.session_holder else None
+        self.sock = self._context.wrap_socket(self.sock,
+                                              server_hostname=server_hostname,
+                                              session=session)
+
+    def save_session(self):
+        """
+        Save TLS session of this connection so it can be used by new connections
+        """
+        if self.sock is not None and self.session_holder is not None:
+            self.session_holder.tls_session = self.sock.session
+
+
 class ConnectionWrapper():
     """
-    HTTP and HTTPS client wrapper class to re-use existing connection
+    HTTP and HTTPS client wrapper class to re-use existing connections
+    Keeps a pool of connections that can be used by multiple threads
     Supports user certificate authentication
     """
 
+    # Methods that can be sent again if it is not known whether server got them
+    IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
     def __init__(self,
                  host,
                  keep_open=False,
                  cert_file=None,
-                 key_file=None):
+                 key_file=None,
+                 max_connections=10,
+                 max_idle_time=4,
+                 connection_attempts=3,
+                 retry_delay=1,
+                 retry_non_idempotent=True):
         self.logger = logging.getLogger('mcm_error')
-        self.connection = None
         host = host.rstrip('/')
         self.https = host.startswith('https://')
         self.host_url = host.replace('https://', '', 1).replace('http://', '', 1)
@@ -35,8 +71,24 @@ class ConnectionWrapper():
         self.cert_file = cert_file or os.getenv('USERCRT', None)
         self.key_file = key_file or os.getenv('USERKEY', None)
         self.keep_open = keep_open
-        self.connection_attempts = 3
+        self.connection_attempts = connection_attempts
+        # Attempt N is followed by retry_delay * N^3 seconds of sleep
+        self.retry_delay = retry_delay
+        # Whether failed requests of methods that are not idempotent are retried
+        self.retry_non_idempotent = retry_non_idempotent
         self.timeout = 120
+        # Maximum number of connections in use at the same time
+        self.max_connections = max_connections
+        # Idle connections older than this are closed instead of re-used
+        # Must be shorter than keep-alive timeout of the server, e.g. 5s in Apache
+        self.max_idle_time = max_idle_time
+        # TLS session of last connection for session resumption
+        self.tls_session = None
+        self.ssl_context = None
+        self.lock = threading.Lock()
+        self.semaphore = threading.BoundedSemaphore(max_connections)
+        # List of (connection, time when it was returned to pool)
+        self.idle_connections = []
 
     def __enter__(self):
         self.logger.debug('Entering context, host: %s', self.host_url)
@@ -46,6 +98,20 @@ class ConnectionWrapper():
         self.logger.debug('Exiting context, host: %s', self.host_url)
         self.close()
 
+    def get_ssl_context(self):
+        """
+        Return SSL context that is shared by all connections of this wrapper
+        """
+        with self.lock:
+            if self.ssl_context is None:
+                context = ssl._create_unverified_context()
+                if self.cert_file and self.key_file:
+                    context.load_cert_chain(self.cert_file, self.key_file)
+
+                self.ssl_context = context
+
+            return self.ssl_context
+
     def init_connection(self):
         """
         Return a new HTTPConnection or HTTPSConnection
@@ -53,33 +119,117 @@ class ConnectionWrapper():
         params = {'host': self.host_url,
                   'port': self.port,
                   'timeout': self.timeout}
-        if self.cert_file and self.key_file:
-            params['cert_file'] = self.cert_file
-            params['key_file'] = self.key_file
-
         if self.https:
             self.logger.info('Creating HTTPS connection for %s', self.host_url)
-            params['context'] = ssl._create_unverified_context()
-            self.connection = client.HTTPSConnection(**params)
-        else:
-            self.logger.info('Creating HTTP connection for %s', self.host_url)
-            self.connection = client.HTTPConnection(**params)
+            params['context'] = self.get_ssl_context()
+            return ResumingHTTPSConnection(session_holder=self, **params)
+
+        self.logger.info('Creating HTTP connection for %s', self.host_url)
+        return client.HTTPConnection(**params)
+
+    def checkout(self):
+        """
+        Take an idle connection from the pool or create a new one
+        Return the connection and whether it was taken from the pool
+        """
+        self.semaphore.acquire()
+        now = time.time()
+        expired = []
+        connection = None
+        with self.lock:
+            while self.idle_connections:
+                idle_connection, returned = self.idle_connections.pop()
+                if now - returned > self.max_idle_time or self.is_closed(idle_connection):
+                    expired.append(idle_connection)
+                    continue
+
+                connection = idle_connection
+                break
+
+            # Remaining connections are older than the one that was taken
+            expired.extend(c for c, returned in self.idle_connections
+                           if now - returned > self.max_idle_time)
+            self.idle_connections = [(c, returned) for c, returned in self.idle_connections
+                                     if now - returned <= self.max_idle_time]
+
+        for expired_connection in expired:
+            self.logger.debug('Closing idle connection for %s', self.host_url)
+            expired_connection.close()
+
+        if connection is not None:
+            return connection, True
+
+        try:
+            return self.init_connection(), False
+        except Exception:
+            self.semaphore.release()
+            raise
+
+    @staticmethod
+    def is_closed(connection):
+        """
+        Return whether idle connection was closed by the server. Idle keep-alive
+        connection is readable only if server closed it
+        """
+        if connection.sock is None:
+            return True
+
+        try:
+            readable, _, _ = select.select([connection.sock], [], [], 0)
+            return bool(readable)
+        except (OSError, ValueError):
+            return True
+
+    def checkin(self, connection, reusable=True):
+        """
+        Return a connection to the pool or close it if it should not be re-used
+        """
+        try:
+            if reusable and self.keep_open:
+                if isinstance(connection, ResumingHTTPSConnection):
+                    connection.save_session()
+
+                with self.lock:
+                    self.idle_connections.append((connection, time.time()))
+            else:
+                connection.close()
+        finally:
+            self.semaphore.release()
 
     def close(self):
         """
-        Close connection if it exists
+        Close all idle connections
         """
-        if self.connection:
+        with self.lock:
+            idle_connections, self.idle_connections = self.idle_connections, []
+
+        for connection, _ in idle_connections:
             self.logger.debug('Closing connection for %s', self.host_url)
-            self.connection.close()
-            self.connection = None
+            connection.close()
 
     def api(self, method, url, data=None, headers=None):
         """
         Make a HTTP request to given url
         """
-        if not self.connection:
-            self.init_connection()
+        status, response = self.request(method, url, data, headers)
+        if status is not None and status != 200:
+            self.logger.error('Error %d while doing %s to %s: %s',
+                              status,
+                              method,
+                              url,
+                              response)
+
+        return response
+
+    def request(self, method, url, data=None, headers=None, idempotent=None):
+        """
+        Make a HTTP request to given url and return response status and body.
+        Status and body are None if request failed after all attempts
+        Requests are idempotent if their method is in IDEMPOTENT_METHODS unless
+        it is said otherwise, e.g. for POST requests that only read data
+        """
+        if idempotent is None:
+            idempotent = method in self.IDEMPOTENT_METHODS
 
         all_headers = {}
         if data and isinstance(data, dict):
@@ -90,47 +240,63 @@ class ConnectionWrapper():
             all_headers.update(headers)
 
         url = url.replace('#', '%23')
-        for attempt in range(1, self.connection_attempts + 1):
-            if attempt != 1:
-                self.logger.debug('%s request to %s attempt %s', method, url, attempt)
-
-            start_time = time.time()
-            try:
-                self.connection.request(method,
-                                        url,
-                                        body=data,
-                                        headers=all_headers)
-                response = self.connection.getresponse()
-                response_to_return = response.read()
-                if response.status != 200:
-                    self.logger.error('Error %d while doing %s to %s: %s',
-                                      response.status,
+        connection, reused = self.checkout()
+        try:
+            for attempt in range(1, self.connection_attempts + 1):
+                if attempt != 1:
+                    self.logger.debug('%s request to %s attempt %s', method, url, attempt)
+
+                start_time = time.time()
+                try:
+                    try:
+                        connection.request(method,
+                                           url,
+                                           body=data,
+                                           headers=all_headers)
+                        response = connection.getresponse()
+                    except (ConnectionError, client.HTTPException) as ex:
+                        # Server might have got the request, do not send it twice
+                        if not reused or not idempotent:
+                            raise
+
+                        # Server closed idle connection, retry at once with a new one
+                        self.logger.debug('Idle connection for %s was closed: %s',
+                                          self.host_url,
+                                          ex)
+                        connection.close()
+                        connection, reused = self.init_connection(), False
+                        connection.request(method,
+                                           url,
+                                           body=data,
+                                           headers=all_headers)
+                        response = connection.getresponse()
+
+                    response_to_return = response.read()
+                    end_time = time.time()
+                    self.logger.debug('%s request to %s%s took %.2f',
                                       method,
+                                      self.host_url,
                                       url,
-                                      response_to_return)
-                    return response_to_return
-
-                if not self.keep_open:
-                    self.close()
-
-                end_time = time.time()
-                self.logger.debug('%s request to %s%s took %.2f',
-                                  method,
-                                  self.host_url,
-                                  url,
-                                  end_time - start_time)
-                return response_to_return
-            except Exception as ex:
-                self.logger.error('Exception while doing a %s to %s: %s',
-                                  method,
-                                  url,
-                                  str(ex))
-                if attempt < self.connection_attempts:
-                    sleep = attempt ** 3
-                    self.logger.debug('Will sleep for %s and retry')
-                    time.sleep(sleep)
-
-                self.init_connection()
-
-        self.logger.error('Request failed after %d attempts', self.connection_attempts)
-        return None
+                                      end_time - start_time)
+                    return response.status, response_to_return
+                except Exception as ex:
+                    self.logger.error('Exception while doing a %s to %s: %s',
+                                      method,
+                                      url,
+                                      str(ex))
+                    connection.close()
+                    if not idempotent and not self.retry_non_idempotent:
+                        connection, reused = self.init_connection(), False
+                        break
+
+                    if attempt < self.connection_attempts:
+                        sleep = self.retry_delay * attempt ** 3
+                        self.logger.debug('Will sleep for %s and retry', sleep)
+                        time.sleep(sleep)
+
+                    connection, reused = self.init_connection(), False
+
+            self.logger.error('%s request to %s failed after %d attempts', method, url, attempt)
+            return None, None
+        finally:
+            self.checkin(connection)
@@ -2,11 +2,16 @@
 Module that contains Database class which handles all operations with database
 """
 import os
+import base64
 import logging
 import json
 import time
-from urllib.request import Request, urlopen
-from urllib.error import HTTPError
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.client import responses
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode, urlsplit
+from connection_wrapper import ConnectionWrapper
 
 
 class Database:
@@ -15,10 +20,36 @@ class Database:
     create, read, update, delete and search for documents
     """
     PAGE_SIZE = 100
+    # Maximum number of keys in one multi-key request
+    KEYS_CHUNK_SIZE = 1000
+    # Number of concurrent requests when fetching projected workflows by name
+    PROJECTION_WORKERS = 16
+    # Keep-alive connection pools shared by all Database instances, one per database URL
+    CONNECTION_WRAPPERS = {}
+    CONNECTION_WRAPPERS_LOCK = threading.Lock()
+    # Document attribute of each filter and whether attribute is a list
+    FILTER_ATTRIBUTES = {'prepid': ('PrepID', False),
+                         'output_dataset': ('OutputDatasets', True),
+                         'input_dataset': ('InputDataset', False),
+                         'campaign': ('Campaigns', True),
+                         'type': ('RequestType', False),
+                         'processing_string': ('ProcessingString', False),
+                         'request': ('Requests', True),
+                         'status': ('RequestStatus', False)}
+    # Filters of list attributes from the most to the least selective. Their
+    # combinations are answered with views, because $elemMatch cannot use JSON indexes
+    LIST_FILTERS_BY_SELECTIVITY = ['request', 'output_dataset', 'campaign']
+    # Attributes that have Mango indexes for combined filter queries. List
+    # attributes are matched with $elemMatch which cannot use JSON indexes
+    INDEXED_ATTRIBUTES = ['PrepID', 'RequestType', 'ProcessingString', 'RequestStatus', 'InputDataset']
+    INDEXES_DESIGN_DOCUMENT = 'filterIndexes'
 
     def __init__(self):
         self.logger = logging.getLogger('logger')
-        self.database_url = os.getenv('DB_URL', 'http://localhost:5984')
+        self.database_url = os.getenv('DB_URL', 'http://localhost:5984').rstrip('/')
+        # Scheme, host and port of database url, path of url is part of request paths
+        url_parts = urlsplit(self.database_url)
+        self.server_url = f'{url_parts.scheme}://{url_parts.netloc}'
         self.workflows_table = self.database_url + '/requests'
         self.workflows_input_dataset_view = self.workflows_table + '/_design/_designDoc/_view/inputDatasets'
         self.workflows_output_datasets_view = self.workflows_table + '/_design/_designDoc/_view/outputDatasets'
@@ -27,7 +58,20 @@ class Database:
         self.workflows_type_view = self.workflows_table + '/_design/_designDoc/_view/types'
         self.workflows_processing_string_view = self.workflows_table + '/_design/_designDoc/_view/processingStrings'
         self.workflows_requests_view = self.workflows_table + '/_design/_designDoc/_view/requests'
+        self.workflows_campaign_rollup_view = self.workflows_table + '/_design/_designDoc/_view/campaignRollup'
+        self.workflows_prepid_rollup_view = self.workflows_table + '/_design/_designDoc/_view/prepidRollup'
         self.settings_table = self.database_url + '/settings'
+        # Views that can be used to filter workflows
+        self.filter_views = {'prepid': self.workflows_prepid_view,
+                             'output_dataset': self.workflows_output_datasets_view,
+                             'input_dataset': self.workflows_input_dataset_view,
+                             'campaign': self.workflows_campaigns_view,
+                             'type': self.workflows_type_view,
+                             'processing_string': self.workflows_processing_string_view,
+                             'request': self.workflows_requests_view}
+        # Reduce views with aggregated statistics of output datasets
+        self.rollup_views = {'campaign': self.workflows_campaign_rollup_view,
+                             'prepid': self.workflows_prepid_rollup_view}
         self.auth_header = os.environ.get('STATS_DB_AUTH_HEADER')
 
     def update_workflow(self, workflow, update_timestamp=True):
@@ -47,22 +91,64 @@ class Database:
         """
         Delete a workflow with a given name
         """
-        workflow = self.get_workflow(workflow_name)
-        if workflow is not None and workflow.get('_rev') is not None:
-            rev = workflow['_rev']
+        rev = self.get_workflow_revisions([workflow_name]).get(workflow_name)
+        if rev is not None:
             url = '%s/%s?rev=%s' % (self.workflows_table, workflow_name, rev)
             self.make_request(url, method='DELETE')
 
+    def write_batch(self, max_size=100, max_age=30, on_error=None):
+        """
+        Return a new batch that collects workflow updates and deletions and
+        writes them to database with _bulk_docs requests
+        """
+        return WorkflowWriteBatch(self, max_size=max_size, max_age=max_age, on_error=on_error)
+
+    def bulk_docs(self, documents):
+        """
+        Create, update or delete (documents with _deleted) multiple workflows
+        in one request. Return a list of per-document results
+        """
+        if not documents:
+            return []
+
+        url = self.workflows_table + '/_bulk_docs'
+        return self.make_request(url, {'docs': documents}, 'POST')
+
+    def get_workflow_revisions(self, workflow_names):
+        """
+        Return a dictionary of workflow names and their current revisions.
+        Workflows that do not exist or are deleted are not included
+        """
+        url = self.workflows_table + '/_all_docs'
+        rows = self.get_rows_with_keys(url, workflow_names)
+        return {row['id']: row['value']['rev'] for row in rows
+                if 'value' in row and not row['value'].get('deleted')}
+
     def get_workflow_count(self):
         """
         Return number of workflows in database
         """
         return self.make_request(self.workflows_table)['doc_count']
 
-    def get_workflow(self, workflow_name):
+    def get_update_sequences(self):
+        """
+        Return update sequences of workflows and settings databases,
+        they change every time anything is written to the databases
+        """
+        return (self.make_request(self.workflows_table)['update_seq'],
+                self.make_request(self.settings_table)['update_seq'])
+
+    def get_workflow(self, workflow_name, fields=None):
         """
         Fetch a workflow with given name
+        If fields are given, only these attributes and _id are fetched
         """
+        if fields:
+            docs, _ = self.find_workflows({'_id': workflow_name},
+                                          limit=1,
+                                          fields=self.get_projection(fields))
+            return docs[0] if docs else None
+
         url = self.workflows_table + '/' + workflow_name
         try:
             return self.make_request(url)
@@ -72,132 +158,537 @@ class Database:
 
             return None
 
-    def get_workflows_with_prepid(self, prepid, page=0, page_size=PAGE_SIZE, include_docs=False):
+    def get_workflow_raw(self, workflow_name):
         """
-        Fetch workflows that have certain prepid (prepid of workflow, not request/task)
+        Fetch a workflow with given name as unparsed JSON bytes
         """
-        include_docs_str = 'True' if include_docs else 'False'
-        url = '%s?key="%s"&limit=%d&skip=%d&include_docs=%s' % (self.workflows_prepid_view,
-                                                                prepid,
-                                                                page_size,
-                                                                page * page_size,
-                                                                include_docs_str)
-        rows = self.make_request(url)['rows']
+        url = self.workflows_table + '/' + workflow_name
+        try:
+            return self.make_request(url, raw=True)
+        except HTTPError as err:
+            if err.code != 404:
+                self.logger.error(str(err))
+
+            return None
+
+    def get_workflows_by_name(self, workflow_names, fields=None):
+        """
+        Fetch multiple workflows with given names. Workflows that do not exist are skipped
+        If fields are given, only these attributes and _id are returned
+        """
+        if fields:
+            return self.get_projected_workflows_by_name(workflow_names, fields)
+
+        url = self.workflows_table + '/_all_docs'
+        rows = self.get_rows_with_keys(url, workflow_names, include_docs=True)
+        return [row['doc'] for row in rows if row.get('doc')]
+
+    def iterate_workflows_by_name(self, workflow_names, fields=None, chunk_size=PAGE_SIZE):
+        """
+        Yield workflows with given names in the same order as names, fetching
+        chunk_size workflows at a time. Workflows that do not exist are skipped
+        """
+        workflow_names = list(dict.fromkeys(workflow_names))
+        for start in range(0, len(workflow_names), chunk_size):
+            yield from self.get_workflows_by_name(workflow_names[start:start + chunk_size], fields)
+
+    def get_projected_workflows_by_name(self, workflow_names, fields):
+        """
+        Fetch given attributes of multiple workflows
+        Mango cannot look up a list of ids without scanning, so every workflow
+        is fetched with its own Mango query by _id, PROJECTION_WORKERS at a time.
+        Whole documents are never fetched. Workflows are returned in the same
+        order as names
+        """
+        workflow_names = list(dict.fromkeys(workflow_names))
+        if not workflow_names:
+            return []
+
+        workers = min(self.PROJECTION_WORKERS, len(workflow_names))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            workflows = executor.map(lambda name: self.get_workflow(name, fields), workflow_names)
+            return [workflow for workflow in workflows if workflow is not None]
+
+    @staticmethod
+    def get_projection(fields):
+        """
+        Return list of given attributes that always has _id
+        """
+        return ['_id'] + [field for field in fields if field != '_id']
+
+    def get_workflows_with_output_datasets(self, datasets, include_docs=False):
+        """
+        Fetch workflows that have any of given output datasets
+        """
+        rows = self.get_rows_with_keys(self.workflows_output_datasets_view,
+                                       datasets,
+                                       include_docs=include_docs)
+        return self.unique_rows(rows, include_docs)
+
+    def get_workflows_with_input_datasets(self, datasets, include_docs=False):
+        """
+        Fetch workflows that have any of given input datasets
+        """
+        rows = self.get_rows_with_keys(self.workflows_input_dataset_view,
+                                       datasets,
+                                       include_docs=include_docs)
+        return self.unique_rows(rows, include_docs)
+
+    def get_rows_with_keys(self, url, keys, include_docs=False):
+        """
+        Fetch rows of _all_docs or a view for multiple keys with POST requests.
+        Keys are de-duplicated and split into chunks of KEYS_CHUNK_SIZE
+        """
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return []
+
         if include_docs:
-            return [x['doc'] for x in rows]
+            url += '?include_docs=True'
+
+        rows = []
+        for start in range(0, len(keys), self.KEYS_CHUNK_SIZE):
+            chunk = keys[start:start + self.KEYS_CHUNK_SIZE]
+            rows.extend(self.make_request(url, {'keys': chunk}, 'POST', idempotent=True)['rows'])
+
+        return rows
 
-        return [x['id'] for x in rows]
+    def unique_rows(self, rows, include_docs=False):
+        """
+        Return unique workflow names or documents from view rows
+        """
+        added = set()
+        result = []
+        for row in rows:
+            if 'id' not in row or row['id'] in added:
+                continue
+
+            added.add(row['id'])
+            result.append(row['doc'] if include_docs else row['id'])
+
+        return result
+
+    def get_workflows_with_prepid(self, prepid, page=0, page_size=PAGE_SIZE, include_docs=False):
+        """
+        Fetch workflows that have certain prepid (prepid of workflow, not request/task)
+        """
+        return self.get_workflows_page('prepid', prepid, page=page, page_size=page_size, include_docs=include_docs)[0]
 
     def get_workflows_with_input_dataset(self, dataset, page=0, page_size=PAGE_SIZE, include_docs=False):
         """
         Fetch workflows that have certain input dataset
         """
-        include_docs_str = 'True' if include_docs else 'False'
-        url = '%s?key="%s"&limit=%d&skip=%d&include_docs=%s' % (self.workflows_input_dataset_view,
-                                                                dataset,
-                                                                page_size,
-                                                                page * page_size,
-                                                                include_docs_str)
-        rows = self.make_request(url)['rows']
-        if include_docs:
-            return [x['doc'] for x in rows]
-
-        return [x['id'] for x in rows]
+        return self.get_workflows_page('input_dataset', dataset, page=page, page_size=page_size, include_docs=include_docs)[0]
 
     def get_workflows_with_output_dataset(self, dataset, page=0, page_size=PAGE_SIZE, include_docs=False):
         """
         Fetch workflows that have certain output dataset
         """
-        include_docs_str = 'True' if include_docs else 'False'
-        url = '%s?key="%s"&limit=%d&skip=%d&include_docs=%s' % (self.workflows_output_datasets_view,
-                                                                dataset,
-                                                                page_size,
-                                                                page * page_size,
-                                                                include_docs_str)
-        rows = self.make_request(url)['rows']
-        if include_docs:
-            return [x['doc'] for x in rows]
-
-        return [x['id'] for x in rows]
+        return self.get_workflows_page('output_dataset', dataset, page=page, page_size=page_size, include_docs=include_docs)[0]
 
     def get_workflows_with_campaign(self, campaign, page=0, page_size=PAGE_SIZE, include_docs=False):
         """
         Fetch workflows that have certain campaign
         """
-        include_docs_str = 'True' if include_docs else 'False'
-        url = '%s?key="%s"&limit=%d&skip=%d&include_docs=%s' % (self.workflows_campaigns_view,
-                                                                campaign,
-                                                                page_size,
-                                                                page * page_size,
-                                                                include_docs_str)
-        rows = self.make_request(url)['rows']
-        if include_docs:
-            return [x['doc'] for x in rows]
-
-        return [x['id'] for x in rows]
+        return self.get_workflows_page('campaign', campaign, page=page, page_size=page_size, include_docs=include_docs)[0]
 
     def get_workflows_with_type(self, workflow_type, page=0, page_size=PAGE_SIZE, include_docs=False):
         """
         Fetch workflows that have certain RequestType
         """
-        include_docs_str = 'True' if include_docs else 'False'
-        url = '%s?key="%s"&limit=%d&skip=%d&include_docs=%s' % (self.workflows_type_view,
-                                                                workflow_type,
-                                                                page_size,
-                                                                page * page_size,
-                                                                include_docs_str)
-        rows = self.make_request(url)['rows']
-        if include_docs:
-            return [x['doc'] for x in rows]
-
-        return [x['id'] for x in rows]
+        return self.get_workflows_page('type', workflow_type, page=page, page_size=page_size, include_docs=include_docs)[0]
 
     def get_workflows_with_processing_string(self, workflow_processing_string, page=0, page_size=PAGE_SIZE, include_docs=False):
         """
         Fetch workflows that have certain processing string
         """
-        include_docs_str = 'True' if include_docs else 'False'
-        url = '%s?key="%s"&limit=%d&skip=%d&include_docs=%s' % (self.workflows_processing_string_view,
-                                                                workflow_processing_string,
-                                                                page_size,
-                                                                page * page_size,
-                                                                include_docs_str)
-        rows = self.make_request(url)['rows']
-        if include_docs:
-            return [x['doc'] for x in rows]
-
-        return [x['id'] for x in rows]
+        return self.get_workflows_page('processing_string', workflow_processing_string, page=page, page_size=page_size, include_docs=include_docs)[0]
 
     def get_workflows_with_request(self, request_name, page=0, page_size=PAGE_SIZE, include_docs=False):
         """
         Fetch workflows that have certain request
         """
-        include_docs_str = 'True' if include_docs else 'False'
-        url = '%s?key="%s"&limit=%d&skip=%d&include_docs=%s' % (self.workflows_requests_view,
-                                                                request_name,
-                                                                page_size,
-                                                                page * page_size,
-                                                                include_docs_str)
-        rows = self.make_request(url)['rows']
-        if include_docs:
-            return [x['doc'] for x in rows]
-
-        return [x['id'] for x in rows]
+        return self.get_workflows_page('request', request_name, page=page, page_size=page_size, include_docs=include_docs)[0]
 
     def get_workflows(self, page=0, page_size=PAGE_SIZE, include_docs=False):
         """
         Fetch workflows
         """
-        include_docs_str = 'True' if include_docs else 'False'
-        url = '%s/_all_docs?limit=%d&skip=%d&include_docs=%s' % (self.workflows_table,
-                                                                 page_size,
-                                                                 page * page_size,
-                                                                 include_docs_str)
-        rows = self.make_request(url)['rows']
+        return self.get_workflows_page(None, None, page=page, page_size=page_size, include_docs=include_docs)[0]
+
+    def get_workflows_with_filters(self, filters, cursor=None, page=0, page_size=PAGE_SIZE, include_docs=False, fields=None):
+        """
+        Fetch a page of workflows that match all given filters - dictionary of
+        filter names (FILTER_ATTRIBUTES keys) and values.
+        A single filter that has a view is fetched from the view, combinations of
+        list filters are intersected from their views, other combinations are
+        fetched with a Mango query.
+        If fields are given, documents with only these attributes and _id are returned
+        Return workflows, cursor of the next page and cursor of the previous page
+        """
+        use_view = not filters or (len(filters) == 1 and next(iter(filters)) in self.filter_views)
+        if fields and filters and not any(self.FILTER_ATTRIBUTES[name][1] for name in filters):
+            # Mango can both find and project documents using indexes
+            use_view = False
+
+        if fields and not filters:
+            return self.get_projected_workflows_page(cursor=cursor,
+                                                     page=page,
+                                                     page_size=page_size,
+                                                     fields=fields)
+
+        if len(filters) > 1 and all(self.FILTER_ATTRIBUTES[name][1] for name in filters):
+            return self.get_intersected_workflows_page(filters,
+                                                       cursor=cursor,
+                                                       page=page,
+                                                       page_size=page_size,
+                                                       include_docs=include_docs,
+                                                       fields=fields)
+
+        if use_view:
+            filter_name, value = next(iter(filters.items())) if filters else (None, None)
+            if not fields:
+                return self.get_workflows_page(filter_name, value, cursor=cursor, page=page,
+                                               page_size=page_size, include_docs=include_docs)
+
+            names, next_cursor, previous_cursor = self.get_workflows_page(filter_name,
+                                                                          value,
+                                                                          cursor=cursor,
+                                                                          page=page,
+                                                                          page_size=page_size)
+            return self.get_workflows_by_name(names, fields), next_cursor, previous_cursor
+
+        selector = {}
+        for filter_name, value in filters.items():
+            attribute, is_list = self.FILTER_ATTRIBUTES[filter_name]
+            selector[attribute] = {'$elemMatch': {'$eq': value}} if is_list else value
+
+        bookmark = None
+        if cursor:
+            position = self.decode_cursor(cursor)
+            bookmark = position.get('bookmark')
+            if not bookmark or position['direction'] != 'next':
+                raise ValueError(f'Invalid cursor {cursor}')
+
+        skip = page * page_size if not bookmark and page > 0 else 0
+        if fields:
+            projection = self.get_projection(fields)
+        else:
+            projection = None if include_docs else ['_id']
+
+        docs, next_bookmark = self.find_workflows(selector,
+                                                  bookmark=bookmark,
+                                                  limit=page_size,
+                                                  fields=projection,
+                                                  skip=skip)
+        next_cursor = None
+        if next_bookmark:
+            next_cursor = self.encode_bookmark_cursor(next_bookmark)
+
+        # Mango bookmarks only go forward, so there is no cursor of previous page
+        if include_docs or fields:
+            return docs, next_cursor, None
+
+        return [x['_id'] for x in docs], next_cursor, None
+
+    def get_intersected_workflows_page(self, filters, cursor=None, page=0, page_size=PAGE_SIZE,
+                                       include_docs=False, fields=None):
+        """
+        Fetch a page of workflows that match all given list filters. Names are
+        taken from the view of the most selective filter and each of them is
+        looked up in views of other filters, so no query scans the database.
+        Workflows are sorted by name, there is no cursor of the previous page
+        Return workflows, cursor of the next page and cursor of the previous page
+        """
+        position = self.decode_cursor(cursor) if cursor else None
+        if position and ('key' not in position or position['direction'] != 'next'):
+            raise ValueError(f'Invalid cursor {cursor}')
+
+        filter_names = sorted(filters, key=self.LIST_FILTERS_BY_SELECTIVITY.index)
+        first_filter = filter_names[0]
+        params = {'startkey': filters[first_filter], 'endkey': filters[first_filter]}
+        url = self.filter_views[first_filter] + '?' + self.encode_view_params(params)
+        names = sorted({row['id'] for row in self.make_request(url)['rows']})
+        for filter_name in filter_names[1:]:
+            if not names:
+                break
+
+            names = self.get_names_in_view(filter_name, filters[filter_name], names)
+
+        if position and position.get('inclusive'):
+            names = [name for name in names if name >= position['key']]
+        elif position:
+            names = [name for name in names if name > position['key']]
+        elif page > 0:
+            names = names[page * page_size:]
+
+        next_cursor = None
+        if len(names) > page_size:
+            next_cursor = self.encode_cursor({'key': names[page_size], 'id': names[page_size]},
+                                             'next',
+                                             inclusive=True)
+
+        names = names[:page_size]
+        if fields or include_docs:
+            return self.get_workflows_by_name(names, fields), next_cursor, None
+
+        return names, next_cursor, None
+
+    def get_names_in_view(self, filter_name, value, workflow_names):
+        """
+        Return those of given workflow names that have a row with given value
+        in the view of a filter. Every name is looked up by key and document id
+        with multi-query requests
+        """
+        url = self.filter_views[filter_name] + '/queries'
+        found = []
+        for start in range(0, len(workflow_names), self.KEYS_CHUNK_SIZE):
+            chunk = workflow_names[start:start + self.KEYS_CHUNK_SIZE]
+            queries = [{'startkey': value,
+                        'endkey': value,
+                        'startkey_docid': name,
+                        'endkey_docid': name,
+                        'limit': 1} for name in chunk]
+            results = self.make_request(url, {'queries': queries}, 'POST', idempotent=True)['results']
+            found.extend(name for name, result in zip(chunk, results) if result['rows'])
+
+        return found
+
+    def get_projected_workflows_page(self, cursor=None, page=0, page_size=PAGE_SIZE, fields=None):
+        """
+        Fetch a page of all workflows with only given attributes and _id using
+        Mango range on _id, which is served by _all_docs without a scan.
+        Cursors are the same as cursors of _all_docs pages of get_workflows_page
+        Return workflows, cursor of the next page and cursor of the previous page
+        """
+        position = self.decode_cursor(cursor) if cursor else None
+        if position and 'key' not in position:
+            raise ValueError(f'Invalid cursor {cursor}')
+
+        backwards = bool(position) and position['direction'] == 'previous'
+        if position:
+            operator = '$lt' if backwards else '$gt'
+            if position.get('inclusive'):
+                operator += 'e'
+
+            selector = {'_id': {operator: position['key']}}
+        else:
+            selector = {'_id': {'$gt': None}}
+
+        skip = page * page_size if not position and page > 0 else 0
+        docs, _ = self.find_workflows(selector,
+                                      limit=page_size + 1,
+                                      fields=self.get_projection(fields),
+                                      skip=skip,
+                                      sort=[{'_id': 'desc' if backwards else 'asc'}])
+        rows = [{'key': doc['_id'], 'id': doc['_id'], 'doc': doc} for doc in docs]
+        rows, next_cursor, previous_cursor = self.get_page_cursors(rows,
+                                                                   page_size,
+                                                                   bool(position) or page > 0,
+                                                                   backwards)
+        return [row['doc'] for row in rows], next_cursor, previous_cursor
+
+    def get_workflows_page(self, filter_name, value, cursor=None, page=0, page_size=PAGE_SIZE, include_docs=False):
+        """
+        Fetch a page of workflows that have given value of a filter (one of filter_views
+        keys) or all workflows if filter name is None.
+        If cursor is given, page is fetched right after or right before the row in the
+        cursor, so it costs the same no matter how deep it is, otherwise page number
+        is used with skip.
+        Return workflows, cursor of the next page and cursor of the previous page,
+        cursors are None if there are no such pages
+        """
+        if filter_name is None:
+            url = self.workflows_table + '/_all_docs'
+        else:
+            url = self.filter_views[filter_name]
+
+        params = {'include_docs': 'true' if include_docs else 'false',
+                  'limit': page_size + 1}
+        position = self.decode_cursor(cursor) if cursor else None
+        if position and ('key' not in position or 'id' not in position):
+            raise ValueError(f'Invalid cursor {cursor}')
+
+        backwards = bool(position) and position['direction'] == 'previous'
+        if position:
+            # Page starts at the row in the cursor. Row of an exclusive cursor
+            # is removed below if it still exists, skip would drop another row
+            # if it does not
+            params['startkey'] = position['key']
+            if not position.get('inclusive'):
+                params['limit'] = page_size + 2
+
+            if backwards:
+                params['descending'] = 'true'
+
+            if filter_name is not None:
+                params['startkey_docid'] = position['id']
+                params['endkey'] = value
+        else:
+            if filter_name is not None:
+                params['startkey'] = value
+                params['endkey'] = value
+
+            if page > 0:
+                params['skip'] = page * page_size
+
+        rows = self.make_request(url + '?' + self.encode_view_params(params))['rows']
+        if position and not position.get('inclusive'):
+            if rows and rows[0]['key'] == position['key'] and rows[0]['id'] == position['id']:
+                rows = rows[1:]
+
+            rows = rows[:page_size + 1]
+
+        rows, next_cursor, previous_cursor = self.get_page_cursors(rows,
+                                                                   page_size,
+                                                                   bool(position) or page > 0,
+                                                                   backwards)
+
         if include_docs:
-            return [x['doc'] for x in rows]
+            return [x['doc'] for x in rows], next_cursor, previous_cursor
+
+        return [x['id'] for x in rows], next_cursor, previous_cursor
+
+    def get_rollup(self, filter_name, value):
+        """
+        Fetch sums of workflow statistics of workflows with given value of a filter
+        (one of rollup_views keys) from a reduce view.
+        Return sums of all workflows and dictionary of sums of each datatier or
+        None if there are no such workflows
+        """
+        params = {'group_level': 2,
+                  'startkey': [value],
+                  'endkey': [value, {}]}
+        url = self.rollup_views[filter_name] + '?' + self.encode_view_params(params)
+        rows = self.make_request(url)['rows']
+        totals = None
+        datatiers = {}
+        for row in rows:
+            datatier = row['key'][1]
+            if datatier is None:
+                totals = row['value']
+            else:
+                datatiers[datatier] = row['value']
+
+        if totals is None:
+            return None
+
+        return totals, datatiers
+
+    def find_workflows(self, selector, bookmark=None, limit=PAGE_SIZE, fields=None, skip=0, sort=None):
+        """
+        Fetch a page of workflows that match a Mango selector.
+        Return documents and bookmark of the next page, bookmark is None
+        if there are no more documents
+        """
+        query = {'selector': selector, 'limit': limit}
+        if bookmark:
+            query['bookmark'] = bookmark
+
+        if skip:
+            query['skip'] = skip
+
+        if sort:
+            query['sort'] = sort
+
+        if fields:
+            query['fields'] = fields
+
+        response = self.make_request(self.workflows_table + '/_find', query, 'POST', idempotent=True)
+        docs = response.get('docs', [])
+        next_bookmark = response.get('bookmark') if len(docs) == limit else None
+        return docs, next_bookmark
+
+    @staticmethod
+    def encode_view_params(params):
+        """
+        Encode view query parameters, keys are JSON encoded
+        """
+        encoded = {}
+        for name, value in params.items():
+            if name in ('startkey', 'endkey', 'key'):
+                value = json.dumps(value)
+
+            encoded[name] = value
+
+        return urlencode(encoded)
+
+    def get_page_cursors(self, rows, page_size, has_earlier, backwards):
+        """
+        Split page_size + 1 view rows into rows of the page, cursor of the next
+        page and cursor of the previous page. Extra row is the first row of the
+        following page, so its cursor is inclusive, cursors made from rows of
+        the page exclude that row
+        """
+        extra_row = rows[page_size] if len(rows) > page_size else None
+        rows = rows[:page_size]
+        next_cursor = None
+        previous_cursor = None
+        if backwards:
+            rows = rows[::-1]
+            if rows:
+                next_cursor = self.encode_cursor(rows[-1], 'next')
+
+            if extra_row:
+                previous_cursor = self.encode_cursor(extra_row, 'previous', inclusive=True)
+        else:
+            if extra_row:
+                next_cursor = self.encode_cursor(extra_row, 'next', inclusive=True)
+
+            if rows and has_earlier:
+                previous_cursor = self.encode_cursor(rows[0], 'previous')
+
+        return rows, next_cursor, previous_cursor
+
+    @staticmethod
+    def encode_cursor(row, direction, inclusive=False):
+        """
+        Make an opaque cursor token from a view row. Page of inclusive cursor
+        starts with the row, otherwise it starts right after the row
+        """
+        position = {'key': row['key'], 'id': row['id'], 'direction': direction}
+        if inclusive:
+            position['inclusive'] = True
+
+        cursor = json.dumps(position, separators=(',', ':'))
+        return base64.urlsafe_b64encode(cursor.encode('utf-8')).decode('utf-8')
+
+    @staticmethod
+    def encode_bookmark_cursor(bookmark):
+        """
+        Make an opaque cursor token from a Mango bookmark
+        """
+        cursor = json.dumps({'bookmark': bookmark, 'direction': 'next'}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(cursor.encode('utf-8')).decode('utf-8')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """
+        Decode cursor token made by encode_cursor
+        """
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+        except ValueError as ex:
+            raise ValueError(f'Invalid cursor {cursor}') from ex
+
+        if not isinstance(position, dict) or position.get('direction') not in ('next', 'previous'):
+            raise ValueError(f'Invalid cursor {cursor}')
 
-        return [x['id'] for x in rows]
+        return position
+
+    def ensure_indexes(self):
+        """
+        Create Mango indexes of INDEXED_ATTRIBUTES that do not exist yet
+        """
+        url = self.workflows_table + '/_index'
+        for attribute in self.INDEXED_ATTRIBUTES:
+            index = {'index': {'fields': [attribute]},
+                     'ddoc': self.INDEXES_DESIGN_DOCUMENT,
+                     'name': attribute,
+                     'type': 'json'}
+            result = self.make_request(url, index, 'POST')
+            if result.get('result') == 'created':
+                self.logger.info('Created Mango index of %s', attribute)
 
     def set_setting(self, setting_name, setting_value):
         """
@@ -224,20 +715,210 @@ class Database:
 
         return settings_dict.get(setting_name, default_value)
 
-    def make_request(self, url, data=None, method='GET'):
+    def get_connection_wrapper(self):
+        """
+        Return connection pool for the database that is shared between instances
+        """
+        with self.CONNECTION_WRAPPERS_LOCK:
+            connection_wrapper = self.CONNECTION_WRAPPERS.get(self.server_url)
+            if connection_wrapper is None:
+                # Web requests should fail fast if database is down and writes
+                # are not repeated if it is not known whether they were done
+                connection_wrapper = ConnectionWrapper(self.server_url,
+                                                       keep_open=True,
+                                                       max_connections=32,
+                                                       connection_attempts=2,
+                                                       retry_delay=0.2,
+                                                       retry_non_idempotent=False)
+                self.CONNECTION_WRAPPERS[self.server_url] = connection_wrapper
+
+            return connection_wrapper
+
+    @classmethod
+    def close_connections(cls):
+        """
+        Close and forget all shared connection pools, e.g. in a new worker process
+        """
+        with cls.CONNECTION_WRAPPERS_LOCK:
+            connection_wrappers = list(cls.CONNECTION_WRAPPERS.values())
+            cls.CONNECTION_WRAPPERS.clear()
+
+        for connection_wrapper in connection_wrappers:
+            connection_wrapper.close()
+
+    def make_request(self, url, data=None, method='GET', raw=False, idempotent=None):
         """
         Make a HTTP request to the actual database api
+        If raw is True, return response bytes without parsing them
+        Set idempotent for POST requests that only read data, so they can be retried
         """
         if data is not None:
-            data = json.dumps(data)
-
-        req = Request(url, data=data, method=method)
-        if method in ('POST', 'PUT') and data is not None:
-            data = data.encode("utf-8")
+            data = json.dumps(data).encode('utf-8')
 
-        req.add_header('Content-Type', 'application/json')
+        headers = {'Content-Type': 'application/json'}
         if self.auth_header:
-            req.add_header('Authorization', self.auth_header)
+            headers['Authorization'] = self.auth_header
+
+        path = url[len(self.server_url):] if url.startswith(self.server_url) else url
+        status, response = self.get_connection_wrapper().request(method,
+                                                                 path,
+                                                                 data,
+                                                                 headers,
+                                                                 idempotent=idempotent)
+        if status is None:
+            raise URLError(f'{method} request to {url} failed')
+
+        if status >= 400:
+            raise HTTPError(url, status, responses.get(status, ''), None, None)
+
+        if raw:
+            return response
+
+        return json.loads(response.decode('utf-8'))
+
+
+class WorkflowWriteBatch:
+    """
+    Buffer of workflow updates and deletions that are written to the database
+    with _bulk_docs when batch reaches max_size documents, when oldest buffered
+    document is older than max_age seconds or when batch is flushed explicitly.
+    Batch can be shared between threads
+    """
+
+    def __init__(self, database, max_size=100, max_age=30, on_error=None):
+        self.logger = logging.getLogger('logger')
+        self.database = database
+        self.max_size = max(1, max_size)
+        self.max_age = max_age
+        # Function that is called with document id, error and reason
+        # for every document that could not be written
+        self.on_error = on_error
+        # Document results with errors, e.g. conflicts, since batch creation
+        self.errors = []
+        self.lock = threading.Lock()
+        self.updates = []
+        self.deletions = []
+        self.first_added = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.flush()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.updates) + len(self.deletions)
+
+    def update_workflow(self, workflow, update_timestamp=True, callback=None):
+        """
+        Add workflow to the batch. Optional callback is called with the
+        workflow after it is successfully written to database
+        """
+        if update_timestamp:
+            workflow['LastUpdate'] = int(time.time())
+
+        with self.lock:
+            self.updates.append((workflow, callback))
+
+        self.flush_if_needed()
+
+    def delete_workflow(self, workflow_name, rev=None):
+        """
+        Add workflow deletion to the batch. If revision is not known, it is
+        fetched together with other deletions when batch is flushed
+        """
+        with self.lock:
+            self.deletions.append((workflow_name, rev))
 
-        response = json.loads(urlopen(req, data=data).read().decode('utf-8'))
-        return response
+        self.flush_if_needed()
+
+    def flush_if_needed(self):
+        """
+        Flush the batch if it reached size or age threshold
+        """
+        with self.lock:
+            size = len(self.updates) + len(self.deletions)
+            if not size:
+                return
+
+            now = time.time()
+            if self.first_added is None:
+                self.first_added = now
+
+            if size < self.max_size and now - self.first_added < self.max_age:
+                return
+
+        self.flush()
+
+    def flush(self):
+        """
+        Write all buffered documents to database and return list of
+        per-document results
+        """
+        with self.lock:
+            updates, self.updates = self.updates, []
+            deletions, self.deletions = self.deletions, []
+            self.first_added = None
+
+        if not updates and not deletions:
+            return []
+
+        documents = [workflow for workflow, _ in updates]
+        callbacks = {workflow['_id']: (workflow, callback) for workflow, callback in updates}
+        unknown_revisions = [name for name, rev in deletions if rev is None]
+        start_time = time.time()
+        try:
+            revisions = {}
+            if unknown_revisions:
+                revisions = self.database.get_workflow_revisions(unknown_revisions)
+
+            for workflow_name, rev in deletions:
+                rev = rev or revisions.get(workflow_name)
+                if rev is None:
+                    self.logger.info('Not deleting %s because it is not in database', workflow_name)
+                    continue
+
+                documents.append({'_id': workflow_name, '_rev': rev, '_deleted': True})
+
+            results = self.database.bulk_docs(documents)
+        except (HTTPError, URLError) as err:
+            # Every document of the batch is reported, so none of them is lost silently
+            batch_ids = list(dict.fromkeys([doc['_id'] for doc in documents]
+                                           + [name for name, _ in deletions]))
+            self.logger.error('Error writing %d documents with _bulk_docs: %s', len(batch_ids), err)
+            results = [{'id': doc_id, 'error': 'http_error', 'reason': str(err)}
+                       for doc_id in batch_ids]
+
+        end_time = time.time()
+        failed = 0
+        for result in results:
+            doc_id = result.get('id')
+            if result.get('error'):
+                failed += 1
+                self.logger.error('Error writing %s: %s (%s)',
+                                  doc_id,
+                                  result['error'],
+                                  result.get('reason'))
+                with self.lock:
+                    self.errors.append(result)
+
+                if self.on_error:
+                    self.on_error(doc_id, result['error'], result.get('reason'))
+
+                continue
+
+            workflow, callback = callbacks.get(doc_id, (None, None))
+            if workflow is not None:
+                workflow['_rev'] = result.get('rev')
+                if callback:
+                    try:
+                        callback(workflow)
+                    except Exception as ex:
+                        self.logger.error('Error after writing %s: %s', doc_id, ex)
+
+        self.logger.info('Wrote %d documents (%d failed) with _bulk_docs in %.3fs',
+                         len(documents),
+                         failed,
+                         end_time - start_time)
+        return results
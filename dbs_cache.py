@@ -0,0 +1,207 @@
+"""
+Module that contains PersistentDBSCache class
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+
+class PersistentDBSCache():
+    """
+    On-disk SQLite cache of DBS responses that is kept between update runs.
+    Entries are keyed by dataset name and dataset access type and are
+    revalidated with list of datasets that were modified in DBS
+    Number of entries is kept in memory and access times of hits are written
+    in batches of ACCESS_BATCH_SIZE
+    """
+
+    ACCESS_BATCH_SIZE = 1000
+
+    def __init__(self, path, max_entries=200000):
+        self.logger = logging.getLogger('logger')
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS filesummaries ('
+                                'dataset TEXT NOT NULL, '
+                                'access_type TEXT NOT NULL, '
+                                'fetched INTEGER NOT NULL, '
+                                'accessed REAL NOT NULL, '
+                                'value TEXT NOT NULL, '
+                                'PRIMARY KEY (dataset, access_type))')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS filesummaries_accessed '
+                                'ON filesummaries (accessed)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS metadata ('
+                                'name TEXT PRIMARY KEY, '
+                                'value REAL NOT NULL)')
+        self.connection.commit()
+        self.count = self.connection.execute('SELECT COUNT(*) FROM filesummaries').fetchone()[0]
+        # (dataset, access type) -> time of last hit that is not written yet
+        self.access_times = {}
+
+    def __len__(self):
+        with self.lock:
+            return self.count
+
+    def get(self, dataset_name, dataset_access_type=None):
+        """
+        Return cached value or None if there is no entry
+        """
+        key = (dataset_name, dataset_access_type or '')
+        with self.lock:
+            row = self.connection.execute('SELECT value FROM filesummaries '
+                                          'WHERE dataset = ? AND access_type = ?',
+                                          key).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.access_times[key] = time.time()
+            if len(self.access_times) >= self.ACCESS_BATCH_SIZE:
+                self.__write_access_times()
+                self.connection.commit()
+
+        return json.loads(row[0])
+
+    def __write_access_times(self):
+        """
+        Write buffered access times of hits, lock must be held
+        """
+        if not self.access_times:
+            return
+
+        self.connection.executemany('UPDATE filesummaries SET accessed = ? '
+                                    'WHERE dataset = ? AND access_type = ?',
+                                    [(accessed, *key) for key, accessed in self.access_times.items()])
+        self.access_times = {}
+
+    def set(self, dataset_name, dataset_access_type, value):
+        """
+        Store value in cache and evict least recently used entries if
+        cache has more than max_entries entries
+        """
+        now = time.time()
+        key = (dataset_name, dataset_access_type or '')
+        with self.lock:
+            updated = self.connection.execute('UPDATE filesummaries '
+                                              'SET fetched = ?, accessed = ?, value = ? '
+                                              'WHERE dataset = ? AND access_type = ?',
+                                              (int(now), now, json.dumps(value), *key)).rowcount
+            if not updated:
+                self.connection.execute('INSERT INTO filesummaries '
+                                        '(dataset, access_type, fetched, accessed, value) '
+                                        'VALUES (?, ?, ?, ?, ?)',
+                                        (*key, int(now), now, json.dumps(value)))
+                self.count += 1
+
+            self.access_times.pop(key, None)
+            if self.count > self.max_entries:
+                # Least recently used entries are chosen with up to date access times
+                self.__write_access_times()
+                to_evict = self.count - self.max_entries
+                evicted = self.connection.execute('DELETE FROM filesummaries WHERE rowid IN '
+                                                  '(SELECT rowid FROM filesummaries '
+                                                  'ORDER BY accessed LIMIT ?)',
+                                                  (to_evict, )).rowcount
+                self.count -= evicted
+                self.evictions += evicted
+
+            self.connection.commit()
+
+    def invalidate(self, dataset_names):
+        """
+        Remove entries of given datasets
+        """
+        with self.lock:
+            removed = 0
+            for dataset_name in dataset_names:
+                removed += self.connection.execute('DELETE FROM filesummaries WHERE dataset = ?',
+                                                   (dataset_name, )).rowcount
+
+            self.count -= removed
+            self.connection.commit()
+
+        self.logger.info('Removed %d entries of %d datasets from DBS cache %s',
+                         removed,
+                         len(dataset_names),
+                         self.path)
+        return removed
+
+    def revalidate(self, modified_datasets, since_timestamp, checked_timestamp):
+        """
+        Drop entries that can no longer be trusted: entries of datasets that
+        were modified after entry was fetched. modified_datasets is a list of
+        DBS dataset dictionaries with 'dataset' and optional
+        'last_modification_date' attributes that covers modifications from
+        since_timestamp to checked_timestamp. If cache was last revalidated
+        before since_timestamp, modifications in between are unknown, so all
+        entries are dropped
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT value FROM metadata '
+                                          'WHERE name = \'revalidated_until\'').fetchone()
+            revalidated_until = row[0] if row else None
+            removed = 0
+            if revalidated_until is None or revalidated_until < since_timestamp:
+                self.logger.info('DBS cache %s was last revalidated at %s, before %s, '
+                                 'dropping all entries',
+                                 self.path,
+                                 revalidated_until,
+                                 since_timestamp)
+                removed += self.connection.execute('DELETE FROM filesummaries').rowcount
+
+            for dataset in modified_datasets:
+                # Without modification date assume that dataset was modified just now
+                modification_date = dataset.get('last_modification_date') or time.time()
+                removed += self.connection.execute('DELETE FROM filesummaries '
+                                                   'WHERE dataset = ? AND fetched <= ?',
+                                                   (dataset['dataset'],
+                                                    modification_date)).rowcount
+
+            self.count -= removed
+            self.connection.execute('INSERT OR REPLACE INTO metadata (name, value) '
+                                    'VALUES (\'revalidated_until\', ?)',
+                                    (checked_timestamp, ))
+            self.connection.commit()
+
+        self.logger.info('Removed %d outdated entries from DBS cache %s', removed, self.path)
+        return removed
+
+    def flush(self):
+        """
+        Write buffered access times
+        """
+        with self.lock:
+            self.__write_access_times()
+            self.connection.commit()
+
+    def log_stats(self):
+        """
+        Log cache hit and miss counters
+        """
+        total = self.hits + self.misses
+        hit_rate = self.hits / total * 100.0 if total else 0.0
+        self.logger.info('DBS cache %s: %d entries, %d hits, %d misses (%.2f%% hit rate), '
+                         '%d evictions',
+                         self.path,
+                         len(self),
+                         self.hits,
+                         self.misses,
+                         hit_rate,
+                         self.evictions)
+
+    def close(self):
+        """
+        Close database connection
+        """
+        with self.lock:
+            self.__write_access_times()
+            self.connection.commit()
+            self.connection.close()
@@ -0,0 +1,40 @@
+"""
+Gunicorn configuration of Stats2 website for production
+gunicorn --config gunicorn.conf.py main:app
+Values can be overwritten with environment variables below or gunicorn
+command line arguments
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('STATS_BIND', '127.0.0.1:8000')
+# Worker processes, each of them serves requests with a pool of threads
+workers = int(os.getenv('STATS_WEB_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+threads = int(os.getenv('STATS_WEB_THREADS', 4))
+worker_class = 'gthread'
+# Import the app once in master process, workers are forked with it already loaded
+preload_app = True
+# /api/fetch and /md can take a while on big queries
+timeout = int(os.getenv('STATS_WEB_TIMEOUT', 120))
+# Time for requests in progress to finish after SIGTERM
+graceful_timeout = int(os.getenv('STATS_WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+# Gunicorn removes pid file when it exits
+pidfile = os.getenv('STATS_PID_FILE', 'stats.pid')
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    """
+    Do not share database connections of master process with workers
+    """
+    from couchdb_database import Database
+    Database.close_connections()
+
+
+def worker_exit(server, worker):
+    """
+    Close idle database connections of a worker that is stopping
+    """
+    from couchdb_database import Database
+    Database.close_connections()
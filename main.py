@@ -4,50 +4,221 @@ Module that starts webserver and has all it's endpoints
 import os
 import json
 import time
+import atexit
+import hashlib
+import functools
+import tempfile
 import argparse
 import re
 import logging
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
 from flask import (
     Flask,
     render_template, 
     request, 
     make_response, 
     redirect,
+    abort,
     Response,
-    jsonify
+    jsonify,
+    stream_with_context
 )
 from flask_restful import Api
+from compression import ResponseCompressor
 from couchdb_database import Database
-from utils import setup_console_logging, get_unique_list, get_nice_size, comma_separate_thousands
+from page_cache import RenderedPageCache
+from utils import (
+    setup_console_logging,
+    get_unique_list,
+    get_nice_size,
+    comma_separate_thousands,
+    get_latest_dataset_stats,
+    TTLCache
+)
 from stats_update import StatsUpdate
+from update_jobs import UpdateJobQueue
 
 
 app = Flask(__name__,
             static_folder='./html/static',
             template_folder='./html')
 api = Api(app)
+ResponseCompressor(min_size=int(os.getenv('STATS_COMPRESSION_MIN_SIZE', 1024)),
+                   gzip_level=int(os.getenv('STATS_GZIP_LEVEL', 6)),
+                   brotli_quality=int(os.getenv('STATS_BROTLI_QUALITY', 5)),
+                   zstd_level=int(os.getenv('STATS_ZSTD_LEVEL', 3))).init_app(app)
 
 # Set up logging
 setup_console_logging()
 
+# Rendered HTML pages, invalidated when anything is written to the database
+page_cache = RenderedPageCache(lambda: Database().get_update_sequences(),
+                               max_bytes=int(os.getenv('STATS_PAGE_CACHE_BYTES', 64 * 1024 * 1024)),
+                               max_age=int(os.getenv('STATS_PAGE_CACHE_MAX_AGE', 60)))
+# Recent search query -> redirect URL
+search_cache = TTLCache(max_entries=1000, ttl=300)
+# Threads for concurrent search probes
+search_executor = ThreadPoolExecutor(max_workers=16)
+# Workflow updates requested with /api/update
+update_jobs = UpdateJobQueue(lambda workflow_name: StatsUpdate().perform_update_one(workflow_name=workflow_name),
+                             max_workers=int(os.getenv('STATS_UPDATE_WORKERS', 2)),
+                             jobs_dir=os.getenv('STATS_UPDATE_JOBS_DIR',
+                                                os.path.join(tempfile.gettempdir(), 'stats_update_jobs')))
+# Seconds that clients and proxies may use responses without revalidating them
+HTTP_MAX_AGE = int(os.getenv('STATS_HTTP_MAX_AGE', 0))
+
+
+def is_not_modified(etag, last_modified=None):
+    """
+    Check if request's If-None-Match or If-Modified-Since header
+    matches given ETag or last modification timestamp
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+
+    if request.if_modified_since and last_modified:
+        return int(last_modified) <= request.if_modified_since.timestamp()
+
+    return False
+
+
+def add_cache_headers(response, etag, last_modified=None):
+    """
+    Add ETag, Last-Modified and Cache-Control headers to response
+    """
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = int(last_modified)
+
+    response.cache_control.public = True
+    if HTTP_MAX_AGE > 0:
+        response.cache_control.max_age = HTTP_MAX_AGE
+    else:
+        response.cache_control.no_cache = True
+
+    return response
+
+
+def get_variant_etag(validator):
+    """
+    Return ETag of a validator and current request path and query
+    """
+    variant = json.dumps([validator, request.path, request.query_string.decode('utf-8')])
+    return hashlib.md5(variant.encode('utf-8')).hexdigest()
+
+
+def conditional_listing(view):
+    """
+    Decorator of endpoints that list workflows: respond with 304 Not Modified
+    without fetching workflows if database did not change since client's copy
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = get_variant_etag(page_cache.get_validator())
+        last_modified = page_cache.validator_since
+        if is_not_modified(etag, last_modified):
+            return add_cache_headers(make_response('', 304), etag, last_modified)
+
+        response = make_response(view(*args, **kwargs))
+        if response.status_code != 200:
+            return response
+
+        return add_cache_headers(response, etag, last_modified)
+
+    return wrapper
+
+
 @app.route('/get_json/<string:workflow_name>')
 @app.route('/api/get_json/<string:workflow_name>')
 def html_view_json(workflow_name):
     """
     Return one workflow
+    Document is returned as it is stored in database, add pretty=true
+    to get it indented and with sorted keys
+    Add fields=A,B to get only these attributes of the document
+    Document revision is used as ETag
     """
     database = Database()
-    workflow = database.get_workflow(workflow_name)
+    rev = database.get_workflow_revisions([workflow_name]).get(workflow_name)
+    if rev is None:
+        response = make_response("{}", 404)
+        response.headers['Content-Type'] = 'application/json'
+        return response
+
+    # Other representations of the same revision have different ETags
+    etag = rev if not request.query_string else rev + '-' + get_variant_etag(rev)[:12]
+    if is_not_modified(etag):
+        return add_cache_headers(make_response('', 304), etag)
+
+    pretty = request.args.get('pretty', '').lower() in ('1', 'true', 'yes')
+    fields = get_requested_fields()
+    if pretty or fields:
+        workflow = database.get_workflow(workflow_name, fields)
+        if workflow is not None:
+            workflow = json.dumps(workflow, indent=2 if pretty else None, sort_keys=pretty)
+    else:
+        workflow = database.get_workflow_raw(workflow_name)
+
     if workflow is None:
         response = make_response("{}", 404)
     else:
-        response = make_response(json.dumps(workflow, indent=2, sort_keys=True), 200)
+        response = add_cache_headers(make_response(workflow, 200), etag)
 
     response.headers['Content-Type'] = 'application/json'
     return response
 
 
+# Maximum number of workflows in one /api/get_json_bulk request
+BULK_MAX_WORKFLOWS = 10000
+
+
+@app.route('/api/get_json_bulk', methods=['POST'])
+def html_view_json_bulk():
+    """
+    Return multiple workflows with names given in request body, either as a list
+    of names or as {"workflows": [names], "fields": [attributes]}
+    Workflows are streamed as JSON list or, with format=ndjson, one per line
+    Workflows that do not exist are skipped
+    """
+    body = request.get_json(silent=True)
+    fields = get_requested_fields()
+    if isinstance(body, dict):
+        fields = body.get('fields') or fields
+        body = body.get('workflows')
+
+    if not isinstance(body, list) or not all(isinstance(name, str) for name in body):
+        abort(400, 'Request body must be a list of workflow names')
+
+    if fields is not None and (not isinstance(fields, list)
+                               or not all(isinstance(field, str) for field in fields)):
+        abort(400, 'Fields must be a list of attribute names')
+
+    if len(body) > BULK_MAX_WORKFLOWS:
+        abort(400, f'At most {BULK_MAX_WORKFLOWS} workflows can be fetched at once')
+
+    workflows = Database().iterate_workflows_by_name(body, fields)
+    if request.args.get('format') == 'ndjson':
+        return Response(stream_with_context(json.dumps(workflow, sort_keys=True) + '\n'
+                                            for workflow in workflows),
+                        mimetype='application/x-ndjson')
+
+    return Response(stream_with_context(stream_workflows_as_json_list(workflows)),
+                    mimetype='application/json')
+
+
+def stream_workflows_as_json_list(workflows):
+    """
+    Yield given workflows as parts of a JSON list
+    """
+    separator = '[\n'
+    for workflow in workflows:
+        yield separator + json.dumps(workflow, sort_keys=True)
+        separator = ',\n'
+
+    yield '[]\n' if separator == '[\n' else '\n]\n'
+
+
 def report_as_markdown(workflows: list[dict]) -> str:
     """
     Parse the result of a query as markdown picking only the
@@ -67,46 +238,77 @@ def report_as_markdown(workflows: list[dict]) -> str:
         # INFO: There are no results for this query
         return ""
 
-    workflows_df: pd.DataFrame = pd.DataFrame(workflows)
-    subset: pd.DataFrame = workflows_df[["RequestName", "InputDataset", "OutputDatasets"]]
-
-    # Fill NaN values with ""
-    subset = subset.fillna("")
-
-    # Parse and include links
+    # Each row is a list of cells and each cell is a list of lines
+    rows: list[list[list[str]]] = [
+        [cell.strip().split("\n") for cell in get_markdown_cells(workflow)]
+        for workflow in workflows
+    ]
+
+    # Pad columns to the widest line like the pipe format of tabulate,
+    # which also keeps two spaces of padding after each header
+    widths: list[int] = [
+        max([len(header) + 2] + [len(line) for row in rows for line in row[column]])
+        for column, header in enumerate(MARKDOWN_FIELDS)
+    ]
+    lines: list[str] = [
+        format_markdown_line(MARKDOWN_FIELDS, widths),
+        "|" + "|".join(":" + "-" * (width + 1) for width in widths) + "|",
+    ]
+    for row in rows:
+        height: int = max(len(cell) for cell in row)
+        for index in range(height):
+            line_cells = [cell[index] if index < len(cell) else "" for cell in row]
+            lines.append(format_markdown_line(line_cells, widths))
+
+    return "\n".join(lines)
+
+
+def get_markdown_cells(workflow: dict) -> list[str]:
+    """
+    Return RequestName, InputDataset and OutputDatasets cells of a workflow
+    formatted with links to Stats2 and CMS Web DAS.
+    """
     STATS_WORKFLOW_URL = "https://cms-pdmv-prod.web.cern.ch/stats/?workflow_name="
     CMS_WEB_DAS_URL = "https://cmsweb.cern.ch/das/request?view=list&limit=50&instance=prod%2Fglobal&input=dataset%3D"
 
-    subset["RequestName"] = subset["RequestName"].apply(
-        lambda workflow: (
-            f"[{workflow}]({STATS_WORKFLOW_URL}{workflow})"
-            if workflow else workflow
-        )
-    )
-    subset["InputDataset"] = subset["InputDataset"].apply(
-        lambda input_dataset: (
-            f"[{input_dataset}]({CMS_WEB_DAS_URL}{input_dataset})"
-            if input_dataset else input_dataset
-        )
-    )
-    subset["OutputDatasets"] = subset["OutputDatasets"].apply(
-        lambda output_datasets: "\n".join(f"- [{el}]({CMS_WEB_DAS_URL}{el})" for el in output_datasets) + "\n "
-    )
+    workflow_name: str = workflow.get("RequestName") or ""
+    input_dataset: str = workflow.get("InputDataset") or ""
+    output_datasets: list[str] = workflow.get("OutputDatasets") or []
+    return [
+        f"[{workflow_name}]({STATS_WORKFLOW_URL}{workflow_name})" if workflow_name else "",
+        f"[{input_dataset}]({CMS_WEB_DAS_URL}{input_dataset})" if input_dataset else "",
+        "\n".join(f"- [{el}]({CMS_WEB_DAS_URL}{el})" for el in output_datasets),
+    ]
+
+
+def format_markdown_line(cells: list[str], widths: list[int]) -> str:
+    """
+    Return one line of markdown table with cells padded to column widths
+    """
+    return "| " + " | ".join(cell.ljust(width) for cell, width in zip(cells, widths)) + " |"
+
+
+# Attributes of workflows that are used in markdown report
+MARKDOWN_FIELDS = ['RequestName', 'InputDataset', 'OutputDatasets']
 
-    return subset.to_markdown(index=False)
 
 @app.route('/md')
+@conditional_listing
 def html_view_markdown():
     """
     Return workflows for a given q= query
+    Only attributes that are used in the report are fetched from database
     """
     page = 0
     workflows = []
-    fetched = [{}]
-    while len(fetched) > 0 and page < 5:
-        fetched = get_page(page)
+    cursor = request.args.get('cursor')
+    while page < 5:
+        fetched, cursor, _ = get_page(page, cursor, MARKDOWN_FIELDS)
         workflows.extend(fetched)
         page += 1
+        if not cursor:
+            break
+
         time.sleep(0.1)
 
     try:
@@ -123,26 +325,110 @@ def html_view_markdown():
 
 
 @app.route('/api/fetch')
+@conditional_listing
 def html_api_fetch():
     """
     Return workflows for a given q= query
+    If there are more workflows, cursor to continue with is returned in X-Next-Cursor header
+    With format=ndjson all workflows are streamed as one JSON document per line
+    Add fields=A,B to get only these attributes of workflows
     """
+    fields = get_requested_fields()
+    if request.args.get('format') == 'ndjson':
+        # First page is fetched before response starts, so invalid cursor is still a 400 error
+        first_page = get_page(0, request.args.get('cursor'), fields)
+        return Response(stream_with_context(stream_workflows_as_ndjson(first_page, fields)),
+                        mimetype='application/x-ndjson')
+
     page = 0
     workflows = []
-    fetched = [{}]
-    while len(fetched) > 0 and page < 100:
-        fetched = get_page(page)
+    cursor = request.args.get('cursor')
+    while page < 100:
+        fetched, cursor, _ = get_page(page, cursor, fields)
         workflows.extend(fetched)
         page += 1
+        if not cursor:
+            break
+
         time.sleep(0.1)
 
     response = make_response(json.dumps(workflows, indent=2, sort_keys=True), 200)
     response.headers['Content-Type'] = 'application/json'
+    if cursor:
+        response.headers['X-Next-Cursor'] = cursor
+
     return response
 
 
+def stream_workflows_as_ndjson(first_page, fields=None):
+    """
+    Yield workflows for a given q= query page by page, one JSON document per line,
+    starting with already fetched first page
+    """
+    page = 0
+    fetched, cursor, _ = first_page
+    while True:
+        for workflow in fetched:
+            yield json.dumps(workflow, sort_keys=True) + '\n'
+
+        if not cursor:
+            break
+
+        page += 1
+        fetched, cursor, _ = get_page(page, cursor, fields)
+
+
+@app.route('/api/rollup')
+@conditional_listing
+def html_rollup():
+    """
+    Return expected and produced events, lumisections and size of all workflows
+    of a campaign=... or prepid=... in total and for each output datatier
+    """
+    filters = [name for name in ('campaign', 'prepid') if request.args.get(name)]
+    if len(filters) != 1:
+        abort(400, 'Exactly one of campaign or prepid must be given')
+
+    filter_name = filters[0]
+    value = request.args.get(filter_name)
+    rollup = Database().get_rollup(filter_name, value)
+    if rollup is None:
+        response = jsonify({'msg': f'There are no workflows with {filter_name} {value}'})
+        response.status_code = 404
+        return response
+
+    totals, datatiers = rollup
+    result = {filter_name: value,
+              'workflows': totals['workflows'],
+              'expected_events': totals['expected_events'],
+              'expected_lumis': totals['expected_lumis'],
+              'datatiers': {}}
+    for datatier, stats in sorted(datatiers.items()):
+        stats = dict(stats)
+        stats['completion'] = get_percentage(stats['events'], stats['expected_events'])
+        stats['lumi_completion'] = get_percentage(stats['lumis'], stats['expected_lumis'])
+        result['datatiers'][datatier] = stats
+
+    return jsonify(result)
+
+
+def get_percentage(value, total):
+    """
+    Return value as percentage of total rounded to two decimal places
+    or None if total is not known
+    """
+    if not total:
+        return None
+
+    return round(value / total * 100.0, 2)
+
+
 @app.route(rule='/api/update', methods=["GET"])
 def update_workflow() -> Response:
+    """
+    Queue an update of a workflow and return the job that can be
+    followed with /api/update/<job_id>
+    """
     error: dict[str, str] = {}
     
     # Get the workflow name from query parameters
@@ -153,24 +439,35 @@ def update_workflow() -> Response:
         response.status_code = 400
         return response
 
-    # Perform the update
-    try:
-        stats_update: StatsUpdate = StatsUpdate()
-        stats_update.perform_update_one(workflow_name=workflow_name)
-        
-        result: dict[str, str] = {"msg": f"Workflow {workflow_name} has been updated successfully"}
-        response = jsonify(result)
-        response.status_code = 200
+    job: dict = update_jobs.submit(workflow_name)
+    result: dict = {
+        "msg": f"Update of workflow {workflow_name} has been queued",
+        "job": job,
+        "status_url": f"/api/update/{job['id']}",
+    }
+    response = jsonify(result)
+    response.status_code = 202
+    return response
+
+
+@app.route(rule='/api/update/<string:job_id>', methods=["GET"])
+def update_workflow_status(job_id: str) -> Response:
+    """
+    Return status of an update job: queued, running, done or failed
+    """
+    job: dict | None = update_jobs.get(job_id)
+    if job is None:
+        response = jsonify({"msg": f"Update job {job_id} does not exist"})
+        response.status_code = 404
         return response
-    except Exception as e:
-        error_msg: str = (
-            f"Unfortunately, there were issues updating workflow: {workflow_name}, there are described below:\n"
-            f"{str(e)}"
+
+    if job["status"] == "failed":
+        job["error"] = (
+            f"Unfortunately, there were issues updating workflow: {job['workflow_name']}, there are described below:\n"
+            f"{job['error']}"
         )
-        error = {"error": error_msg}
-        response = jsonify(error)
-        response.status_code = 500
-        return response
+
+    return jsonify({"job": job})
 
 
 def matches_regex(value, regex):
@@ -296,15 +593,40 @@ def get_time_diff(t1, t2):
 # HTML responses
 @app.route('/')
 @app.route('/<int:page>')
+@conditional_listing
 def html_get(page=0):
     """
     Return HTML of selected page
     This method also prettifies some dates, makes campaigns and requests lists unique,
     calculates completness of output datasets
+    Rendered pages are cached until database changes
+    """
+    cache_key = (page, urlencode(sorted(request.args.items(multi=True))))
+    cache_validator = page_cache.get_validator()
+    content = page_cache.get(cache_key, cache_validator)
+    if content is not None:
+        return content
+
+    content = render_page(page)
+    page_cache.set(cache_key, cache_validator, content)
+    return content
+
+
+@app.route('/api/page_cache')
+def html_page_cache_stats():
+    """
+    Return rendered page cache size and hit/miss counters
+    """
+    return jsonify(page_cache.stats())
+
+
+def render_page(page=0):
+    """
+    Return rendered HTML of selected page
     """
     database = Database()
-    workflows = get_page(page)
-    pages = [page, page > 0, database.PAGE_SIZE == len(workflows)]
+    workflows, next_cursor, previous_cursor = get_page(page, request.args.get('cursor'))
+    pages = [page, previous_cursor is not None, next_cursor is not None]
     workflows = list(filter(lambda req: '_design' not in req['_id'], workflows))
     datetime_format = '%Y&#8209;%m&#8209;%d&nbsp;%H:%M:%S'
     now = int(time.time())
@@ -356,6 +678,11 @@ def html_get(page=0):
 
         total_events = req.get('TotalEvents', 0)
         total_lumisections = req.get('TotalInputLumis', 0)
+        # Documents that were not updated since the field was added do not have it
+        latest_stats = req.get('LatestDatasetStats')
+        if latest_stats is None:
+            latest_stats = get_latest_dataset_stats(req)
+
         for dataset in req['OutputDatasets']:
             new_dataset = {'Name': dataset,
                            'Events': 0,
@@ -364,30 +691,21 @@ def html_get(page=0):
                            'Datatier': dataset.split('/')[-1],
                            'Size': -1,
                            'NiceSize': '0B'}
-            
-            # Retrieve the most recent history entry for the current request
-            history_entries = sorted(
-                req['EventNumberHistory'],
-                key=lambda entry: entry.get('Time', 0),
-                reverse=True
-            )
-            for history_entry in history_entries:
-                history_entry = history_entry['Datasets']
-                if dataset in history_entry:
-                    output_lumisections: int | None = history_entry[dataset].get('Lumis')
-                    new_dataset['Events'] = comma_separate_thousands(history_entry[dataset]['Events'])
-                    new_dataset['Type'] = history_entry[dataset]['Type']
-                    new_dataset['Size'] = history_entry[dataset].get('Size', -1)
-                    new_dataset['NiceSize'] = get_nice_size(new_dataset['Size'])
-                    if total_events > 0:
-                        percentage = history_entry[dataset]['Events'] / total_events * 100.0
-                        new_dataset['CompletedPerc'] = '%.2f' % (percentage)
-                    if output_lumisections and total_lumisections > 0:
-                        new_dataset['Lumis'] = comma_separate_thousands(output_lumisections)
-                        lumi_percentage = output_lumisections / total_lumisections * 100.0
-                        new_dataset['LumiCompletedPerc'] = '%.2f' % (lumi_percentage)
-
-                    break
+
+            dataset_stats = latest_stats.get(dataset)
+            if dataset_stats:
+                output_lumisections: int | None = dataset_stats.get('Lumis')
+                new_dataset['Events'] = comma_separate_thousands(dataset_stats['Events'])
+                new_dataset['Type'] = dataset_stats['Type']
+                new_dataset['Size'] = dataset_stats.get('Size', -1)
+                new_dataset['NiceSize'] = get_nice_size(new_dataset['Size'])
+                if total_events > 0:
+                    percentage = dataset_stats['Events'] / total_events * 100.0
+                    new_dataset['CompletedPerc'] = '%.2f' % (percentage)
+                if output_lumisections and total_lumisections > 0:
+                    new_dataset['Lumis'] = comma_separate_thousands(output_lumisections)
+                    lumi_percentage = output_lumisections / total_lumisections * 100.0
+                    new_dataset['LumiCompletedPerc'] = '%.2f' % (lumi_percentage)
 
             calculated_datasets.append(new_dataset)
 
@@ -407,7 +725,20 @@ def html_get(page=0):
                            workflows=workflows,
                            total_workflows=database.get_workflow_count(),
                            pages=pages,
-                           query=request.query_string.decode('utf-8'))
+                           query=request.query_string.decode('utf-8'),
+                           previous_query=get_query_with_cursor(previous_cursor),
+                           next_query=get_query_with_cursor(next_cursor))
+
+
+def get_query_with_cursor(cursor):
+    """
+    Return current url query with cursor replaced by the given one
+    """
+    args = [(name, value) for name, value in request.args.items(multi=True) if name != 'cursor']
+    if cursor:
+        args.append(('cursor', cursor))
+
+    return urlencode(args)
 
 
 @app.route('/search')
@@ -419,98 +750,115 @@ def html_search():
     if not query:
         return redirect('/stats', code=302)
 
-    database = Database()
-    if database.get_workflows_with_prepid(query, page_size=1):
-        return redirect('/stats?prepid=' + query, code=302)
+    redirect_url = search_cache.get(query)
+    if redirect_url is None:
+        redirect_url = get_search_redirect_url(query)
+        search_cache.set(query, redirect_url)
 
-    if database.get_workflows_with_output_dataset(query, page_size=1):
-        return redirect('/stats?output_dataset=' + query, code=302)
+    return redirect(redirect_url, code=302)
 
-    if database.get_workflows_with_input_dataset(query, page_size=1):
-        return redirect('/stats?input_dataset=' + query, code=302)
 
-    if database.get_workflows_with_campaign(query, page_size=1):
-        return redirect('/stats?campaign=' + query, code=302)
+def get_search_redirect_url(query):
+    """
+    Check all filters at once and return URL of the first filter, in order of
+    SEARCH_PARAMETERS, that has workflows with given value
+    """
+    database = Database()
+    probes = [(parameter, search_executor.submit(database.get_workflows_page,
+                                                 parameter,
+                                                 query,
+                                                 page_size=1))
+              for parameter in SEARCH_PARAMETERS]
+    redirect_url = '/stats?workflow_name=' + query
+    for parameter, probe in probes:
+        if probe.result()[0]:
+            redirect_url = f'/stats?{parameter}={query}'
+            break
 
-    if database.get_workflows_with_type(query, page_size=1):
-        return redirect('/stats?type=' + query, code=302)
+    # Lower priority probes are not needed anymore
+    for _, probe in probes:
+        probe.cancel()
 
-    if database.get_workflows_with_processing_string(query, page_size=1):
-        return redirect('/stats?processing_string=' + query, code=302)
+    return redirect_url
 
-    if database.get_workflows_with_request(query, page_size=1):
-        return redirect('/stats?request=' + query, code=302)
 
-    return redirect('/stats?workflow_name=' + query, code=302)
+# Actual get method
+# Query parameters that are checked by search, in order of precedence
+SEARCH_PARAMETERS = ['prepid',
+                     'output_dataset',
+                     'input_dataset',
+                     'campaign',
+                     'type',
+                     'processing_string',
+                     'request']
+# Query parameters that can be used to filter workflows
+FILTER_PARAMETERS = SEARCH_PARAMETERS + ['status']
+
+
+def get_requested_fields():
+    """
+    Return list of attributes in comma separated fields= query parameter
+    or None if all attributes should be returned
+    """
+    fields = [field.strip() for field in request.args.get('fields', '').split(',')]
+    fields = [field for field in fields if field]
+    return fields or None
 
 
-# Actual get method
-def get_page(page=0):
+def get_page(page=0, cursor=None, fields=None):
     """
-    Return a list of workflows based on url query parameters (if any)
+    Return a list of workflows based on url query parameters (if any), cursor of
+    the next page and cursor of the previous page. If cursor is given, page
+    is fetched relative to the cursor instead of using page number
+    Any combination of filter parameters can be used, workflows must match all of them
+    If fields are given, workflows have only these attributes and _id
     """
     database = Database()
-    prepid = request.args.get('prepid')
-    output_dataset = request.args.get('output_dataset')
-    input_dataset = request.args.get('input_dataset')
-    campaign = request.args.get('campaign')
-    workflow_type = request.args.get('type')
     workflow_name = request.args.get('workflow_name')
-    processing_string = request.args.get('processing_string')
-    request_name = request.args.get('request')
     if page < 0:
         page = 0
 
     if workflow_name is not None:
-        req = database.get_workflow(workflow_name)
+        req = database.get_workflow(workflow_name, fields)
         if req is not None:
-            workflows = [req]
-        else:
-            workflows = []
+            return [req], None, None
 
-    else:
-        if prepid is not None:
-            workflows = database.get_workflows_with_prepid(prepid,
-                                                           page=page,
-                                                           include_docs=True)
-        elif output_dataset is not None:
-            workflows = database.get_workflows_with_output_dataset(output_dataset,
-                                                                   page=page,
-                                                                   include_docs=True)
-        elif input_dataset is not None:
-            workflows = database.get_workflows_with_input_dataset(input_dataset,
-                                                                  page=page,
-                                                                  include_docs=True)
-        elif campaign is not None:
-            workflows = database.get_workflows_with_campaign(campaign,
-                                                             page=page,
-                                                             include_docs=True)
-        elif workflow_type is not None:
-            workflows = database.get_workflows_with_type(workflow_type,
-                                                         page=page,
-                                                         include_docs=True)
-        elif processing_string is not None:
-            workflows = database.get_workflows_with_processing_string(processing_string,
-                                                                      page=page,
-                                                                      include_docs=True)
-        elif request_name is not None:
-            workflows = database.get_workflows_with_request(request_name,
-                                                            page=page,
-                                                            include_docs=True)
-        else:
-            workflows = database.get_workflows(page=page,
-                                               include_docs=True)
-
-    if prepid is not None or output_dataset is not None or input_dataset is not None or request_name is not None:
+        return [], None, None
+
+    filters = {parameter: request.args.get(parameter) for parameter in FILTER_PARAMETERS
+               if request.args.get(parameter) is not None}
+    try:
+        workflows, next_cursor, previous_cursor = database.get_workflows_with_filters(filters,
+                                                                                      cursor=cursor,
+                                                                                      page=page,
+                                                                                      include_docs=True,
+                                                                                      fields=fields)
+    except ValueError:
+        abort(400, 'Invalid cursor')
+
+    if set(filters) & {'prepid', 'output_dataset', 'input_dataset', 'request'}:
         workflows = sorted(workflows,
-                           key=lambda wf: '_'.join(wf.get('RequestName').split('_')[-3:-1]))
+                           key=lambda wf: '_'.join(wf.get('RequestName', wf['_id']).split('_')[-3:-1]))
+
+    return workflows, next_cursor, previous_cursor
+
 
-    return workflows
+def remove_pid_file(path, pid):
+    """
+    Remove pid file if it still belongs to given process
+    """
+    try:
+        with open(path) as pid_file:
+            if pid_file.read().strip() == str(pid):
+                os.remove(path)
+    except OSError:
+        pass
 
 
 def run_flask():
     """
-    Parse command line arguments and start flask web server
+    Parse command line arguments and start flask development web server
+    Use gunicorn with gunicorn.conf.py in production
     """
     parser = argparse.ArgumentParser(description='Stats2')
     parser.add_argument('--port',
@@ -534,6 +882,8 @@ def run_flask():
         with open('stats.pid', 'w') as pid_file:
             pid_file.write(str(pid))
 
+        atexit.register(remove_pid_file, 'stats.pid', pid)
+
     app.run(host=host,
             port=port,
             debug=debug,
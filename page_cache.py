@@ -0,0 +1,117 @@
+"""
+Module that contains RenderedPageCache class
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+
+class RenderedPageCache():
+    """
+    In-process LRU cache of rendered pages
+    Every entry is stored with a validator - a value that changes when data in
+    database changes, e.g. database update sequence. Entries with a different
+    validator than the current one and entries older than max_age are not used
+    """
+
+    def __init__(self, validator_function, max_bytes=64 * 1024 * 1024, max_age=60, validator_ttl=5):
+        self.logger = logging.getLogger('logger')
+        # Function that returns current validator
+        self.validator_function = validator_function
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # Current validator is re-used for this many seconds
+        self.validator_ttl = validator_ttl
+        self.lock = threading.Lock()
+        # Key -> (validator, time when it was stored, content)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.validator = None
+        self.validator_time = 0
+        # Time when current validator was seen for the first time
+        self.validator_since = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_validator(self):
+        """
+        Return current validator, it is refreshed at most every validator_ttl seconds
+        """
+        now = time.time()
+        with self.lock:
+            if self.validator is not None and now - self.validator_time < self.validator_ttl:
+                return self.validator
+
+        validator = self.validator_function()
+        with self.lock:
+            if validator != self.validator:
+                self.validator_since = now
+
+            self.validator = validator
+            self.validator_time = now
+
+        return validator
+
+    def get(self, key, validator):
+        """
+        Return cached content or None if it is not in cache or is outdated
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            entry_validator, stored, content = entry
+            if entry_validator != validator or now - stored > self.max_age:
+                self.__remove(key)
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return content
+
+    def set(self, key, validator, content):
+        """
+        Store content in cache and evict least recently used entries
+        if cache is bigger than max_bytes
+        """
+        content_size = len(content)
+        if content_size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.__remove(key)
+
+            self.entries[key] = (validator, time.time(), content)
+            self.size += content_size
+            while self.size > self.max_bytes:
+                oldest_key = next(iter(self.entries))
+                self.__remove(oldest_key)
+                self.evictions += 1
+
+    def __remove(self, key):
+        """
+        Remove entry from cache, lock must be held
+        """
+        _, _, content = self.entries.pop(key)
+        self.size -= len(content)
+
+    def stats(self):
+        """
+        Return dictionary with cache size and hit/miss counters
+        """
+        with self.lock:
+            total = self.hits + self.misses
+            return {'entries': len(self.entries),
+                    'size': self.size,
+                    'max_size': self.max_bytes,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hit_rate': round(self.hits / total * 100.0, 2) if total else 0.0}
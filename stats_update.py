@@ -8,8 +8,13 @@ import json
 import traceback
 import os
 import subprocess
+import threading
+import signal
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from copy import deepcopy
+from urllib.error import HTTPError, URLError
 from couchdb_database import Database
+from dbs_cache import PersistentDBSCache
 from utils import (
     make_cmsweb_request, 
     make_cmsweb_prod_request, 
@@ -18,7 +23,9 @@ from utils import (
     make_request,
     get_client_credentials,
     get_access_token,
-    hash_object
+    hash_object,
+    get_latest_dataset_stats,
+    ThreadSafeCache
 )
 
 
@@ -26,16 +33,49 @@ class StatsUpdate():
     """
     Update workflows in Stats2 database.
     """
-
-    def __init__(self):
+    # Maximum number of datasets in one DBS datasetlist request
+    DATASET_LIST_CHUNK_SIZE = 500
+
+    def __init__(self,
+                 workers=1,
+                 bulk_size=0,
+                 dbs_cache_path=None,
+                 dbs_cache_size=200000,
+                 dbs_requests=4,
+                 reqmgr_batch_size=0,
+                 reqmgr_changes_limit=0):
         self.logger = logging.getLogger('logger')
         self.database = Database()
+        # Number of workflows that are updated concurrently
+        self.workers = max(1, int(workers))
+        # Maximum number of concurrent DBS requests while prefetching datasets
+        self.dbs_requests = max(1, int(dbs_requests))
+        # Number of ReqMgr2 documents fetched in one request, 0 fetches them one by one
+        self.reqmgr_batch_size = max(0, int(reqmgr_batch_size))
+        # Number of RequestManager changes processed and checkpointed at once, 0 is unlimited
+        self.reqmgr_changes_limit = max(0, int(reqmgr_changes_limit))
+        # ReqMgr2 documents fetched in batches that are waiting for update
+        self.reqmgr2_documents = ThreadSafeCache()
+        # Number of documents written in one _bulk_docs request, 0 disables bulk writes
+        self.bulk_size = max(0, int(bulk_size))
+        # Write batch used during update of all changed workflows
+        self.write_batch = None
         # Cache for DBS filesummaries calls
-        self.dataset_filesummaries_cache = {}
+        self.dataset_filesummaries_cache = ThreadSafeCache()
         # Cache for DBS dataset info + filiesummaries calls
-        self.dataset_info_cache = {}
+        self.dataset_info_cache = ThreadSafeCache()
         # Cache for DBS file calls
-        self.dataset_files_cache = {}
+        self.dataset_files_cache = ThreadSafeCache()
+        # On-disk cache of DBS filesummaries calls that is kept between updates
+        self.persistent_dbs_cache = None
+        # Persistent cache entries are used only after they are revalidated
+        self.persistent_dbs_cache_valid = False
+        if dbs_cache_path:
+            self.persistent_dbs_cache = PersistentDBSCache(dbs_cache_path, dbs_cache_size)
+        # Lock for read-modify-write of failed workflows setting
+        self.crashed_workflows_lock = threading.Lock()
+        # Set when daemon should stop
+        self.stop_event = threading.Event()
 
     def perform_update(self, workflow_name=None, trigger_prod=False, trigger_dev=False):
         """
@@ -64,107 +104,456 @@ class StatsUpdate():
         events for files that changed since last update
         """
         update_start = time.time()
-        changed_workflows, deleted_workflows, last_seq = self.get_list_of_changed_workflows()
-        self.logger.info('Will delete %d workflows', len(deleted_workflows))
-        for workflow_name in deleted_workflows:
-            try:
-                self.delete_one(workflow_name)
-            except Exception as ex:
-                self.logger.error('Exception while deleting %s:%s', workflow_name, str(ex))
+        if self.bulk_size:
+            self.write_batch = self.database.write_batch(max_size=self.bulk_size,
+                                                         on_error=self.__on_write_error)
+
+        try:
+            self.__perform_update_new(update_start, trigger_prod, trigger_dev)
+        finally:
+            if self.write_batch is not None:
+                self.write_batch.flush()
+                self.write_batch = None
+
+    def __perform_update_new(self, update_start, trigger_prod=False, trigger_dev=False):
+        """
+        Update and recalculate changed workflows batch by batch of RequestManager
+        changes and save the checkpoints
+        """
+        updated_datasets = None
+        active_workflows = None
+        if self.persistent_dbs_cache is not None:
+            updated_datasets, active_workflows = self.revalidate_persistent_dbs_cache()
 
         previously_crashed_workflows = self.get_list_of_previously_crashed_workflows()
         self.logger.info('Have %d workflows that crashed during last update',
                          len(previously_crashed_workflows))
-        changed_workflows = set(changed_workflows).union(set(previously_crashed_workflows))
-        self.logger.info('Will update %d workflows', len(changed_workflows))
-        for index, workflow_name in enumerate(changed_workflows):
-            try:
-                self.logger.info('Will update %d/%d workflow', index + 1, len(changed_workflows))
-                self.update_one(workflow_name, trigger_prod, trigger_dev)
-                self.remove_from_list_of_crashed_workflows(workflow_name)
-            except Exception as ex:
-                self.add_to_list_of_crashed_workflows(workflow_name)
-                self.logger.error('Exception while updating %s:%s\nTraceback:%s',
-                                  workflow_name,
-                                  str(ex),
-                                  traceback.format_exc())
+        workflows_to_retry = set(previously_crashed_workflows)
+        last_seq = self.database.get_setting('last_reqmgr_sequence', 0)
+        recalculated_workflows = set()
+        changed_count = 0
+        deleted_count = 0
+        has_more_changes = True
+        while has_more_changes:
+            changes = self.get_list_of_changed_workflows(last_seq, self.reqmgr_changes_limit)
+            changed_workflows, deleted_workflows, last_seq, has_more_changes = changes
+            self.logger.info('Will delete %d workflows', len(deleted_workflows))
+            for workflow_name in deleted_workflows:
+                try:
+                    self.delete_one(workflow_name)
+                except Exception as ex:
+                    self.logger.error('Exception while deleting %s:%s', workflow_name, str(ex))
+
+            changed_workflows = set(changed_workflows).union(workflows_to_retry)
+            workflows_to_retry = set()
+            self.update_workflows(changed_workflows, trigger_prod, trigger_dev)
+            # Related workflows and recalculation must see written documents
+            self.flush_write_batch()
+            related_workflows = self.get_workflows_with_same_output(changed_workflows)
+            self.logger.info('There are %s related workflows to %s changed workflows',
+                             len(related_workflows),
+                             len(changed_workflows))
+            workflows_to_recalculate = changed_workflows.union(related_workflows - recalculated_workflows)
+            self.recalculate_workflows(workflows_to_recalculate, trigger_prod, trigger_dev)
+            recalculated_workflows.update(workflows_to_recalculate)
+            # Changes are processed only when all documents are written
+            self.flush_write_batch()
+            self.database.set_setting('last_reqmgr_sequence', last_seq)
+            self.logger.info('Processed RequestManager changes up to %s', last_seq)
+            changed_count += len(changed_workflows)
+            deleted_count += len(deleted_workflows)
 
         update_end = time.time()
         self.logger.info('Finished updating workflows')
-        self.logger.info('Will update event count')
-        related_workflows = self.get_workflows_with_same_output(changed_workflows)
-        self.logger.info('There are %s related workflows to %s changed workflows',
-                         len(related_workflows),
-                         len(changed_workflows))
-        changed_datasets = self.get_list_of_workflows_with_changed_datasets()
-        workflows_to_recalculate = set(changed_workflows).union(set(changed_datasets))
-        workflows_to_recalculate.update(related_workflows)
-        self.logger.info('Will update event count for %d workflows', len(workflows_to_recalculate))
-        for index, workflow_name in enumerate(workflows_to_recalculate):
-            try:
-                self.logger.info('Will update event count for %d/%d',
-                                 index + 1,
-                                 len(workflows_to_recalculate))
-                self.recalculate_one(workflow_name, trigger_prod, trigger_dev)
-                self.remove_from_list_of_crashed_workflows(workflow_name)
-            except Exception as ex:
-                self.add_to_list_of_crashed_workflows(workflow_name)
-                self.logger.error('Exception while updating event count %s:%s\nTraceback:%s',
-                                  workflow_name,
-                                  str(ex),
-                                  traceback.format_exc())
-
+        changed_datasets = self.get_list_of_workflows_with_changed_datasets(updated_datasets,
+                                                                            active_workflows)
+        workflows_to_recalculate = set(changed_datasets) - recalculated_workflows
+        self.recalculate_workflows(workflows_to_recalculate, trigger_prod, trigger_dev)
+        self.flush_write_batch()
         recalculation_end = time.time()
-        self.database.set_setting('last_reqmgr_sequence', last_seq)
         self.database.set_setting('last_dbs_update_date', int(update_start))
         self.logger.info('Updated and deleted %d/%d workflows in %.3fs',
-                         len(changed_workflows), len(deleted_workflows),
+                         changed_count,
+                         deleted_count,
                          (update_end - update_start))
-        self.logger.info('Updated event count for %d workflows in %.3fs',
+        self.logger.info('Updated event count for %d workflows with changed datasets in %.3fs',
                          len(workflows_to_recalculate),
                          (recalculation_end - update_end))
+        if self.persistent_dbs_cache is not None:
+            self.persistent_dbs_cache.flush()
+            self.persistent_dbs_cache.log_stats()
+
+    def run_daemon(self,
+                   trigger_prod=False,
+                   trigger_dev=False,
+                   debounce=60,
+                   dbs_interval=1800,
+                   longpoll_timeout=60,
+                   max_delay=None):
+        """
+        Follow RequestManager changes feed with long polling and update workflows
+        as they change. Changes of the same workflow are collected until workflow
+        does not change for debounce seconds, but not longer than max_delay seconds
+        (default is 10 times debounce) since its first unprocessed change.
+        Workflows with changed datasets are recalculated and workflows that crashed
+        are updated again every dbs_interval seconds.
+        Runs until stop_daemon() is called
+        """
+        if max_delay is None:
+            max_delay = debounce * 10
+
+        self.logger.info('Starting daemon, debounce %ss, DBS interval %ss',
+                         debounce,
+                         dbs_interval)
+        if self.bulk_size:
+            self.write_batch = self.database.write_batch(max_size=self.bulk_size,
+                                                         on_error=self.__on_write_error)
+
+        last_seq = self.database.get_setting('last_reqmgr_sequence', 0)
+        saved_seq = last_seq
+        # Workflow name -> (deleted, time of first unprocessed change,
+        #                   time of last change, number of batch with first unprocessed change)
+        pending_changes = {}
+        # Number of changes feed batch -> sequence that batch was requested since
+        batch_sequences = {}
+        batch_number = 0
+        next_dbs_update = time.time()
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    since_seq = last_seq
+                    changes = self.get_list_of_changed_workflows(since_seq,
+                                                                 limit=self.reqmgr_changes_limit,
+                                                                 longpoll_timeout=longpoll_timeout)
+                    changed_workflows, deleted_workflows, last_seq, _ = changes
+                    batch_number += 1
+                    batch_sequences[batch_number] = since_seq
+                    now = time.time()
+                    changes = [(name, False) for name in changed_workflows]
+                    changes += [(name, True) for name in deleted_workflows]
+                    for workflow_name, deleted in changes:
+                        if workflow_name in pending_changes:
+                            _, first_changed, _, first_batch = pending_changes[workflow_name]
+                        else:
+                            first_changed, first_batch = now, batch_number
+
+                        pending_changes[workflow_name] = (deleted, first_changed, now, first_batch)
+                except Exception as ex:
+                    self.logger.error('Exception while reading changes feed: %s', str(ex))
+                    self.stop_event.wait(longpoll_timeout)
+
+                now = time.time()
+                ready = {name: pending_changes.pop(name) for name, (_, first_changed, last_changed, _)
+                         in list(pending_changes.items())
+                         if now - last_changed >= debounce or now - first_changed >= max_delay}
+                if ready:
+                    self.reset_dbs_caches()
+                    try:
+                        self.__process_daemon_changes({name: change[0] for name, change in ready.items()},
+                                                      trigger_prod,
+                                                      trigger_dev)
+                    except Exception as ex:
+                        self.logger.error('Exception while processing changes:%s\nTraceback:%s',
+                                          str(ex),
+                                          traceback.format_exc())
+                        # Try again after debounce, but keep the batch of the
+                        # first change, so the sequence is not saved past it
+                        for name, (deleted, _, _, first_batch) in ready.items():
+                            pending_changes[name] = (deleted, now, now, first_batch)
+
+                # Save sequence right before the oldest unprocessed change
+                if pending_changes:
+                    oldest_batch = min(change[3] for change in pending_changes.values())
+                    checkpoint_seq = batch_sequences[oldest_batch]
+                else:
+                    oldest_batch = batch_number + 1
+                    checkpoint_seq = last_seq
+
+                for number in [number for number in batch_sequences if number < oldest_batch]:
+                    del batch_sequences[number]
+
+                if checkpoint_seq != saved_seq:
+                    try:
+                        self.database.set_setting('last_reqmgr_sequence', checkpoint_seq)
+                        saved_seq = checkpoint_seq
+                    except Exception as ex:
+                        self.logger.error('Exception while saving changes feed sequence: %s', str(ex))
+
+                if time.time() >= next_dbs_update:
+                    next_dbs_update = time.time() + dbs_interval
+                    self.reset_dbs_caches()
+                    self.__recalculate_daemon_datasets(trigger_prod, trigger_dev)
+        finally:
+            if self.write_batch is not None:
+                self.write_batch.flush()
+                self.write_batch = None
+
+        self.logger.info('Daemon stopped, %d pending changes will be processed next time',
+                         len(pending_changes))
+
+    def stop_daemon(self):
+        """
+        Stop running daemon after current iteration
+        """
+        self.stop_event.set()
+
+    def reset_dbs_caches(self):
+        """
+        Clear in-memory DBS caches, so long running process does not use old values
+        """
+        self.dataset_filesummaries_cache.clear()
+        self.dataset_info_cache.clear()
+        self.dataset_files_cache.clear()
+
+    def __process_daemon_changes(self, changes, trigger_prod=False, trigger_dev=False):
+        """
+        Delete, update and recalculate workflows from changes dictionary of
+        workflow names and whether workflow was deleted
+        """
+        deleted_workflows = [name for name, deleted in changes.items() if deleted]
+        changed_workflows = {name for name, deleted in changes.items() if not deleted}
+        for workflow_name in deleted_workflows:
+            try:
+                self.delete_one(workflow_name)
+            except Exception as ex:
+                self.logger.error('Exception while deleting %s:%s', workflow_name, str(ex))
+
+        self.update_workflows(changed_workflows, trigger_prod, trigger_dev)
+        self.flush_write_batch()
+        related_workflows = self.get_workflows_with_same_output(changed_workflows)
+        self.recalculate_workflows(changed_workflows.union(related_workflows),
+                                   trigger_prod,
+                                   trigger_dev)
+        self.flush_write_batch()
 
-    def update_one(self, workflow_name, trigger_prod=False, trigger_dev=False):
+    def __recalculate_daemon_datasets(self, trigger_prod=False, trigger_dev=False):
+        """
+        Update workflows that crashed and recalculate workflows whose datasets
+        changed since last recalculation
+        """
+        update_start = time.time()
+        try:
+            crashed_workflows = self.get_list_of_previously_crashed_workflows()
+            if crashed_workflows:
+                self.logger.info('Will retry %d workflows that crashed', len(crashed_workflows))
+                self.update_workflows(crashed_workflows, trigger_prod, trigger_dev)
+                self.flush_write_batch()
+        except Exception as ex:
+            self.logger.error('Exception while retrying crashed workflows:%s\nTraceback:%s',
+                              str(ex),
+                              traceback.format_exc())
+
+        try:
+            updated_datasets = None
+            active_workflows = None
+            if self.persistent_dbs_cache is not None:
+                updated_datasets, active_workflows = self.revalidate_persistent_dbs_cache()
+
+            changed_datasets = self.get_list_of_workflows_with_changed_datasets(updated_datasets,
+                                                                                active_workflows)
+            self.recalculate_workflows(changed_datasets, trigger_prod, trigger_dev)
+            self.flush_write_batch()
+            if self.persistent_dbs_cache is not None:
+                self.persistent_dbs_cache.flush()
+
+            self.database.set_setting('last_dbs_update_date', int(update_start))
+        except Exception as ex:
+            self.logger.error('Exception while recalculating changed datasets:%s\nTraceback:%s',
+                              str(ex),
+                              traceback.format_exc())
+
+        self.logger.info('Recalculated workflows with changed datasets in %.3fs',
+                         time.time() - update_start)
+
+    def update_workflows(self, workflow_names, trigger_prod=False, trigger_dev=False):
+        """
+        Update given workflows from RequestManager, fetching RequestManager
+        documents in batches if batch size is set
+        """
+        self.logger.info('Will update %d workflows', len(workflow_names))
+        if not self.reqmgr_batch_size:
+            self.run_for_each_workflow(workflow_names,
+                                       self.__update_one_guarded,
+                                       trigger_prod,
+                                       trigger_dev)
+            return
+
+        workflow_names = list(workflow_names)
+        for start in range(0, len(workflow_names), self.reqmgr_batch_size):
+            chunk = workflow_names[start:start + self.reqmgr_batch_size]
+            for name, document in self.get_documents_from_reqmgr2(chunk).items():
+                self.reqmgr2_documents[name] = document
+
+            self.run_for_each_workflow(chunk,
+                                       self.__update_one_guarded,
+                                       trigger_prod,
+                                       trigger_dev,
+                                       offset=start,
+                                       total=len(workflow_names))
+
+    def recalculate_workflows(self, workflow_names, trigger_prod=False, trigger_dev=False):
+        """
+        Prefetch DBS data and update event count of given workflows
+        """
+        self.logger.info('Will update event count for %d workflows', len(workflow_names))
+        if not workflow_names:
+            return
+
+        self.prefetch_dbs_data(workflow_names)
+        self.run_for_each_workflow(workflow_names,
+                                   self.__recalculate_one_guarded,
+                                   trigger_prod,
+                                   trigger_dev)
+
+    def flush_write_batch(self):
+        """
+        Write all buffered documents to database if write batch is used
+        """
+        if self.write_batch is not None:
+            self.write_batch.flush()
+
+    def __on_write_error(self, workflow_name, error, reason):
+        """
+        Workflows that could not be written in bulk are updated again during next update
+        """
+        self.logger.error('Could not write %s: %s (%s)', workflow_name, error, reason)
+        self.add_to_list_of_crashed_workflows(workflow_name)
+
+    def save_workflow(self, workflow, trigger_prod=False, trigger_dev=False):
+        """
+        Save workflow to database or to the write batch if it is used and
+        trigger outside services once workflow is saved.
+        Return True if workflow was saved, False if it was added to the write batch,
+        then it is removed from list of crashed workflows after it is written
+        """
+        if self.write_batch is None:
+            self.database.update_workflow(workflow)
+            self.trigger_outside(workflow, trigger_prod, trigger_dev)
+            return True
+
+        def on_saved(saved):
+            self.remove_from_list_of_crashed_workflows(saved['_id'])
+            if trigger_prod or trigger_dev:
+                self.trigger_outside(saved, trigger_prod, trigger_dev)
+
+        self.write_batch.update_workflow(workflow, callback=on_saved)
+        return False
+
+    def run_for_each_workflow(self,
+                              workflow_names,
+                              action,
+                              trigger_prod=False,
+                              trigger_dev=False,
+                              offset=0,
+                              total=None):
+        """
+        Run given action for each workflow name. If more than one worker is configured,
+        workflows are processed concurrently in a bounded thread pool.
+        Offset and total are used for progress if workflow names are part of a bigger list
+        """
+        workflow_names = list(workflow_names)
+        if total is None:
+            total = len(workflow_names)
+
+        if self.workers <= 1 or len(workflow_names) <= 1:
+            for index, workflow_name in enumerate(workflow_names, offset):
+                action(index, total, workflow_name, trigger_prod, trigger_dev)
+
+            return
+
+        self.logger.info('Using %d workers for %d workflows', self.workers, len(workflow_names))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(action, index, total, workflow_name, trigger_prod, trigger_dev)
+                       for index, workflow_name in enumerate(workflow_names, offset)]
+            for future in as_completed(futures):
+                # Guarded actions do not raise, this only surfaces programming errors
+                future.result()
+
+    def __update_one_guarded(self, index, total, workflow_name, trigger_prod, trigger_dev):
+        """
+        Update one workflow and keep track of it in the list of crashed workflows
+        """
+        try:
+            self.logger.info('Will update %d/%d workflow', index + 1, total)
+            reqmgr_dict = self.reqmgr2_documents.pop(workflow_name, None)
+            if self.update_one(workflow_name, trigger_prod, trigger_dev, reqmgr_dict):
+                self.remove_from_list_of_crashed_workflows(workflow_name)
+        except Exception as ex:
+            self.add_to_list_of_crashed_workflows(workflow_name)
+            self.logger.error('Exception while updating %s:%s\nTraceback:%s',
+                              workflow_name,
+                              str(ex),
+                              traceback.format_exc())
+
+    def __recalculate_one_guarded(self, index, total, workflow_name, trigger_prod, trigger_dev):
+        """
+        Recalculate event count of one workflow and keep track of it in the list of
+        crashed workflows
+        """
+        try:
+            self.logger.info('Will update event count for %d/%d', index + 1, total)
+            if self.recalculate_one(workflow_name, trigger_prod, trigger_dev):
+                self.remove_from_list_of_crashed_workflows(workflow_name)
+        except Exception as ex:
+            self.add_to_list_of_crashed_workflows(workflow_name)
+            self.logger.error('Exception while updating event count %s:%s\nTraceback:%s',
+                              workflow_name,
+                              str(ex),
+                              traceback.format_exc())
+
+    def update_one(self, workflow_name, trigger_prod=False, trigger_dev=False, reqmgr_dict=None):
         """
         Action to update one workflow's dictionary from RequestManager. If no such
         workflow exist in database, new one will be created.
+        If RequestManager document was already fetched, it can be given as reqmgr_dict
+        Return False if workflow is waiting in the write batch, True otherwise
         """
         self.logger.info('Updating %s', workflow_name)
         update_start = time.time()
-        wf_dict = self.get_new_dict_from_reqmgr2(workflow_name)
+        wf_dict = self.get_new_dict_from_reqmgr2(workflow_name, reqmgr_dict)
         wf_dict_old = self.database.get_workflow(workflow_name)
         if wf_dict_old is None:
             wf_dict_old = {'_id': workflow_name}
             self.logger.info('Inserting %s', workflow_name)
-            self.database.update_workflow(wf_dict_old)
-            wf_dict_old = self.database.get_workflow(workflow_name)
+            if self.write_batch is None:
+                self.database.update_workflow(wf_dict_old)
+                wf_dict_old = self.database.get_workflow(workflow_name)
+
+        if '_rev' in wf_dict_old:
+            wf_dict['_rev'] = wf_dict_old['_rev']
 
-        wf_dict['_rev'] = wf_dict_old['_rev']
         wf_dict['EventNumberHistory'] = wf_dict_old.get('EventNumberHistory', [])
         wf_dict['OutputDatasets'] = self.sort_datasets(wf_dict['OutputDatasets'])
+        wf_dict['LatestDatasetStats'] = get_latest_dataset_stats(wf_dict)
         old_wf_dict_string = json.dumps(wf_dict_old, sort_keys=True)
         new_wf_dict_string = json.dumps(wf_dict, sort_keys=True)
         update_end = time.time()
         if old_wf_dict_string != new_wf_dict_string:
-            self.database.update_workflow(wf_dict)
+            saved = self.save_workflow(wf_dict, trigger_prod, trigger_dev)
             self.logger.info('Updated %s in %.3fs', workflow_name, (update_end - update_start))
-            self.trigger_outside(wf_dict, trigger_prod, trigger_dev)
-        else:
-            self.logger.info('Did not update %s because it did not change. Time: %.3fs',
-                             workflow_name,
-                             (update_end - update_start))
+            return saved
+
+        self.logger.info('Did not update %s because it did not change. Time: %.3fs',
+                         workflow_name,
+                         (update_end - update_start))
+        return True
 
     def delete_one(self, workflow_name):
         """
         Action to delete one workflow from database.
         """
         self.logger.info('Deleting %s', workflow_name)
+        if self.write_batch is not None:
+            self.write_batch.delete_workflow(workflow_name)
+            return
+
         self.database.delete_workflow(workflow_name)
         self.logger.info('Deleted %s', workflow_name)
 
     def recalculate_one(self, workflow_name, trigger_prod=False, trigger_dev=False):
         """
         Action to update event count for workflow.
+        Return False if workflow is waiting in the write batch, True otherwise
         """
         recalc_start = time.time()
         self.logger.info('Updating event count for %s', workflow_name)
@@ -172,28 +561,53 @@ class StatsUpdate():
         if workflow is None:
             self.logger.warning('Will not update %s event count because it\'s no longer in database',
                                 workflow_name)
-            return
+            return True
 
         history_entry = self.get_new_history_entry(workflow)
         added_history_entry = self.add_history_entry_to_workflow(workflow, history_entry)
         recalc_end = time.time()
         if added_history_entry:
-            self.database.update_workflow(workflow)
+            saved = self.save_workflow(workflow, trigger_prod, trigger_dev)
             self.logger.info('Updated event count for %s in %.3fs',
                              workflow_name,
                              (recalc_end - recalc_start))
-            self.trigger_outside(workflow, trigger_prod, trigger_dev)
-        else:
-            self.logger.info('Did not update event count for %s because it did not change. Time: %.3fs',
-                             workflow_name,
-                             (recalc_end - recalc_start))
+            return saved
+
+        self.logger.info('Did not update event count for %s because it did not change. Time: %.3fs',
+                         workflow_name,
+                         (recalc_end - recalc_start))
+        return True
 
-    def get_new_dict_from_reqmgr2(self, workflow_name):
+    def get_documents_from_reqmgr2(self, workflow_names):
+        """
+        Get multiple workflow documents from RequestManager with one request.
+        Return a dictionary of workflow names and documents, workflows that
+        could not be fetched are not included
+        """
+        if not workflow_names:
+            return {}
+
+        url = '/couchdb/reqmgr_workload_cache/_all_docs?include_docs=true'
+        response = make_cmsweb_request(url, {'keys': list(workflow_names)})
+        if not isinstance(response, dict) or 'rows' not in response:
+            self.logger.error('Could not get %d documents from ReqMgr2: %s',
+                              len(workflow_names),
+                              response)
+            return {}
+
+        documents = {row['id']: row['doc'] for row in response['rows'] if row.get('doc')}
+        self.logger.info('Got %d/%d documents from ReqMgr2', len(documents), len(workflow_names))
+        return documents
+
+    def get_new_dict_from_reqmgr2(self, workflow_name, wf_dict=None):
         """
         Get workflow dictionary from RequestManager.
+        If RequestManager document was already fetched, it can be given as wf_dict
         """
-        url = f'/couchdb/reqmgr_workload_cache/{workflow_name}'
-        wf_dict = make_cmsweb_request(url)
+        if wf_dict is None:
+            url = f'/couchdb/reqmgr_workload_cache/{workflow_name}'
+            wf_dict = make_cmsweb_request(url)
+
         expected_events = self.get_expected_events_with_dict(wf_dict)
         expected_lumis = self.get_expected_lumis_with_dict(wf_dict)
         campaigns = self.get_campaigns_from_workflow(wf_dict)
@@ -227,6 +641,10 @@ class StatsUpdate():
         wf_dict = pick_attributes(wf_dict, attributes)
         wf_dict['RequestTransition'] = [{'Status': tr['Status'],
                                          'UpdateTime': tr['UpdateTime']} for tr in wf_dict.get('RequestTransition', [])]
+        if wf_dict['RequestTransition']:
+            # Last transition status as a plain attribute, so it can be indexed
+            wf_dict['RequestStatus'] = wf_dict['RequestTransition'][-1]['Status']
+
         wf_dict['_id'] = workflow_name
         wf_dict['TotalEvents'] = expected_events
         wf_dict['TotalInputLumis'] = expected_lumis
@@ -270,14 +688,34 @@ class StatsUpdate():
 
         return {}
 
+    def __get_cached_filesummaries(self, dataset_name, dataset_access_type=None):
+        """
+        Get file summary for given dataset from cache or DBS
+        """
+        def fetch_filesummaries():
+            persistent_cache = self.persistent_dbs_cache
+            if persistent_cache is not None and self.persistent_dbs_cache_valid:
+                file_summary = persistent_cache.get(dataset_name, dataset_access_type)
+                if file_summary is not None:
+                    return file_summary
+
+            file_summary = self.__get_filesummaries_from_dbs(dataset_name, dataset_access_type)
+            if persistent_cache is not None:
+                persistent_cache.set(dataset_name, dataset_access_type, file_summary)
+
+            return file_summary
+
+        return self.dataset_filesummaries_cache.get_or_compute(dataset_name, fetch_filesummaries)
+
     def _get_files_from_dbs(self, dataset_name, lumi_list, dataset_access_type=None):
         """Get the file details related to a dataset and a lumi list."""
         lumi_hash = hash_object(lumi_list)
         cache_key = (dataset_name, lumi_hash)
-        files = []
-        if cache_key not in self.dataset_files_cache:
-            for run_number, lumi_list in lumi_list.items():
-                lumi_list_param = str(lumi_list).replace(' ', '')
+
+        def fetch_files():
+            files = []
+            for run_number, run_lumi_list in lumi_list.items():
+                lumi_list_param = str(run_lumi_list).replace(' ', '')
                 query_url = f'/dbs/prod/global/DBSReader/files?dataset={dataset_name}&detail=true&run_num={int(run_number)}&lumi_list={lumi_list_param}'
                 if dataset_access_type in ('PRODUCTION', 'VALID'):
                     query_url += '&validFileOnly=1'
@@ -285,12 +723,9 @@ class StatsUpdate():
                 if files_response:
                     files.extend(files_response)
 
-            # Save it in cache
-            self.dataset_files_cache[cache_key] = files
-        else:
-            files = self.dataset_files_cache[cache_key]
+            return files
 
-        return files
+        return self.dataset_files_cache.get_or_compute(cache_key, fetch_files)
 
     def lumis_should_be_retrieved(self, doc):
         """
@@ -317,16 +752,11 @@ class StatsUpdate():
         Get list of workflow names that have the same output datasets as given workflows
         """
         datasets = set()
-        for workflow_name in workflow_names:
-            workflow = self.database.get_workflow(workflow_name)
+        for workflow in self.database.get_workflows_by_name(workflow_names):
             datasets.update(workflow.get('OutputDatasets', []))
 
-        same_output_workflows = set()
-        for dataset in datasets:
-            dataset_workflows = self.database.get_workflows_with_output_dataset(dataset, page_size=1000)
-            same_output_workflows.update(dataset_workflows)
-
-        return same_output_workflows
+        same_output_workflows = self.database.get_workflows_with_output_datasets(datasets)
+        return set(same_output_workflows)
 
     def get_event_count_from_dbs(self, dataset_name, dataset_access_type=None, lumi_list=None):
         """
@@ -340,11 +770,7 @@ class StatsUpdate():
                 num_events += file.get("event_count", 0)
             return num_events
 
-        if dataset_name not in self.dataset_filesummaries_cache:
-            file_summary = self.__get_filesummaries_from_dbs(dataset_name, dataset_access_type)
-            self.dataset_filesummaries_cache[dataset_name] = file_summary
-        else:
-            file_summary = self.dataset_filesummaries_cache[dataset_name]
+        file_summary = self.__get_cached_filesummaries(dataset_name, dataset_access_type)
 
         num_event = int(file_summary.get('num_event', 0))
         return num_event
@@ -353,11 +779,7 @@ class StatsUpdate():
         """
         Get size for specified dataset from DBS.
         """
-        if dataset_name not in self.dataset_filesummaries_cache:
-            file_summary = self.__get_filesummaries_from_dbs(dataset_name)
-            self.dataset_filesummaries_cache[dataset_name] = file_summary
-        else:
-            file_summary = self.dataset_filesummaries_cache[dataset_name]
+        file_summary = self.__get_cached_filesummaries(dataset_name)
 
         file_size = int(file_summary.get('file_size', 0))
         return file_size
@@ -366,15 +788,90 @@ class StatsUpdate():
         """
         Get the lumisections for specified dataset from DBS.
         """
-        if dataset_name not in self.dataset_filesummaries_cache:
-            file_summary = self.__get_filesummaries_from_dbs(dataset_name)
-            self.dataset_filesummaries_cache[dataset_name] = file_summary
-        else:
-            file_summary = self.dataset_filesummaries_cache[dataset_name]
+        file_summary = self.__get_cached_filesummaries(dataset_name)
 
         lumisections = int(file_summary.get('num_lumi', 0))
         return lumisections
 
+    def prefetch_dbs_data(self, workflow_names):
+        """
+        Fill dataset caches for all output datasets of given workflows: get access
+        types with few big datasetlist requests and then get file summaries with
+        up to dbs_requests concurrent requests
+        Prefetching is best-effort: datasets of chunks that fail are not cached
+        and are fetched again during recalculation of each workflow
+        """
+        prefetch_start = time.time()
+        # Callers pass sets too
+        workflow_names = sorted(workflow_names)
+        datasets = set()
+        chunk_size = self.database.PAGE_SIZE
+        for start in range(0, len(workflow_names), chunk_size):
+            try:
+                chunk = workflow_names[start:start + chunk_size]
+                workflows = self.database.get_workflows_by_name(chunk, fields=['OutputDatasets'])
+            except Exception as ex:
+                self.logger.error('Exception while getting datasets to prefetch: %s', str(ex))
+                continue
+
+            for workflow in workflows:
+                datasets.update(workflow.get('OutputDatasets', []))
+
+        datasets = sorted(dataset for dataset in datasets if dataset not in self.dataset_info_cache)
+        if not datasets:
+            return
+
+        self.logger.info('Prefetching DBS data of %d datasets', len(datasets))
+        dataset_list_url = '/dbs/prod/global/DBSReader/datasetlist'
+        access_types = {}
+        listed_datasets = []
+        for start in range(0, len(datasets), self.DATASET_LIST_CHUNK_SIZE):
+            chunk = datasets[start:start + self.DATASET_LIST_CHUNK_SIZE]
+            try:
+                dbs_dataset_list = make_cmsweb_prod_request(dataset_list_url,
+                                                            {'dataset': chunk,
+                                                             'detail': 1,
+                                                             'dataset_access_type': '*'})
+                if not isinstance(dbs_dataset_list, list):
+                    raise ValueError(f'Unexpected datasetlist response: {dbs_dataset_list}')
+
+                chunk_access_types = {dbs_dataset['dataset']: dbs_dataset['dataset_access_type']
+                                      for dbs_dataset in dbs_dataset_list}
+            except Exception as ex:
+                self.logger.error('Exception while prefetching %d dataset access types: %s',
+                                  len(chunk),
+                                  str(ex))
+                continue
+
+            access_types.update(chunk_access_types)
+            listed_datasets.extend(chunk)
+
+        def prefetch_dataset(dataset_name):
+            dataset_access_type = access_types.get(dataset_name)
+            if dataset_access_type is None:
+                # Same dummy record as in get_new_history_entry
+                cache_entry = {'Type': 'NONE', 'Events': 0, 'Size': 0}
+            else:
+                cache_entry = {'Type': dataset_access_type,
+                               'Events': self.get_event_count_from_dbs(dataset_name,
+                                                                       dataset_access_type),
+                               'Size': self.get_dataset_size_from_dbs(dataset_name)}
+
+            self.dataset_info_cache[dataset_name] = cache_entry
+
+        with ThreadPoolExecutor(max_workers=self.dbs_requests) as executor:
+            futures = [executor.submit(prefetch_dataset, dataset_name) for dataset_name in listed_datasets]
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as ex:
+                    # Dataset will be fetched again during recalculation
+                    self.logger.error('Exception while prefetching DBS data: %s', str(ex))
+
+        self.logger.info('Prefetched DBS data of %d datasets in %.3fs',
+                         len(listed_datasets),
+                         time.time() - prefetch_start)
+
     def get_new_history_entry(self, wf_dict):
         """
         Form a new history entry dictionary for given workflow.
@@ -392,22 +889,23 @@ class StatsUpdate():
         for output_dataset in set(output_datasets):
             if output_dataset in self.dataset_info_cache:
                 # Trying to find type, events and size in cache
-                cache_entry = self.dataset_info_cache[output_dataset]
+                cache_entry = dict(self.dataset_info_cache[output_dataset])
 
                 # Check if the cache entry requires/has lumisections
-                # attributes
-                if not include_lumisections or (
-                    include_lumisections 
-                    and 
-                    bool(cache_entry.get("Lumis"))
-                ):
-                    self.logger.info(
-                        'Found cache entry for dataset %s: %s', 
-                        output_dataset, 
-                        json.dumps(cache_entry, indent=5)
-                    )
-                    history_entry['Datasets'][output_dataset] = cache_entry
-                    output_datasets_set.remove(output_dataset)
+                # attributes, file summary with lumisections is in cache
+                # if dataset info is in cache
+                if include_lumisections and 'Lumis' not in cache_entry:
+                    cache_entry['Lumis'] = 0
+                    if cache_entry['Type'] != 'NONE':
+                        cache_entry['Lumis'] = self.get_dataset_lumisections(output_dataset)
+
+                self.logger.info(
+                    'Found cache entry for dataset %s: %s', 
+                    output_dataset, 
+                    json.dumps(cache_entry, indent=5)
+                )
+                history_entry['Datasets'][output_dataset] = cache_entry
+                output_datasets_set.remove(output_dataset)
             else:
                 # Add dataset to list of datasets that are not in cache
                 output_datasets_to_query.append(output_dataset)
@@ -540,6 +1038,7 @@ class StatsUpdate():
             ]
 
         wf_dict['EventNumberHistory'] = history_entries
+        wf_dict['LatestDatasetStats'] = get_latest_dataset_stats(wf_dict)
         # self.logger.info(json.dumps(history_entry, indent=2))
         return True
 
@@ -764,16 +1263,36 @@ class StatsUpdate():
         dataset_list = sorted(dataset_list, key=tier_priority)
         return dataset_list
 
-    def get_list_of_changed_workflows(self):
+    def get_list_of_changed_workflows(self, last_seq=None, limit=0, longpoll_timeout=0):
         """
-        Get list of workflows that changed in RequestManager since last update.
+        Get list of workflows that changed in RequestManager since given sequence
+        or since last update. If limit is given, at most limit changes are returned.
+        If longpoll timeout is given, wait up to that many seconds for new changes.
+        Return changed and deleted workflows, sequence of the last returned change
+        and whether there are more changes to get
         """
-        last_seq = self.database.get_setting('last_reqmgr_sequence', 0)
+        if last_seq is None:
+            last_seq = self.database.get_setting('last_reqmgr_sequence', 0)
+
         url = f'/couchdb/reqmgr_workload_cache/_changes?since={last_seq}'
-        self.logger.info('Getting the list of all workflows since %d from %s', last_seq, url)
-        response = make_cmsweb_request(url)
+        if limit:
+            url += f'&limit={limit}'
+
+        if longpoll_timeout:
+            url += f'&feed=longpoll&timeout={int(longpoll_timeout * 1000)}'
+            self.logger.info('Waiting for changes of workflows since %s from %s', last_seq, url)
+            response = make_cmsweb_request(url, timeout=longpoll_timeout + 30)
+        else:
+            self.logger.info('Getting the list of all workflows since %s from %s', last_seq, url)
+            response = make_cmsweb_request(url)
+
         last_seq = response['last_seq']
         wf_list = response['results']
+        has_more = False
+        if limit:
+            # Older CouchDB versions do not return number of pending changes
+            has_more = response.get('pending', len(wf_list)) > 0 and len(wf_list) >= limit
+
         changed_wf_list = list(filter(lambda x: not x.get('deleted', False), wf_list))
         changed_wf_list = [wf['id'] for wf in changed_wf_list]
         changed_wf_list = list(filter(lambda x: '_design' not in x, changed_wf_list))
@@ -783,11 +1302,11 @@ class StatsUpdate():
         self.logger.info('Got %d updated workflows. Got %d deleted workflows.',
                          len(changed_wf_list),
                          len(deleted_wf_list))
-        return changed_wf_list, deleted_wf_list, last_seq
+        return changed_wf_list, deleted_wf_list, last_seq, has_more
 
-    def get_updated_dataset_list_from_dbs(self, since_timestamp=0):
+    def get_updated_datasets_from_dbs(self, since_timestamp=0):
         """
-        Get list of datasets that changed since last update.
+        Get DBS dictionaries of datasets that changed since last update.
         """
         url = f'/dbs/prod/global/DBSReader/datasets?min_ldate={since_timestamp}&dataset_access_type=*'
         self.logger.info('Getting the list of modified datasets since %d from %s',
@@ -799,26 +1318,70 @@ class StatsUpdate():
                               since_timestamp,
                               url)
 
-        dataset_list = [dataset['dataset'] for dataset in dataset_list]
         self.logger.info('Got %d datasets', len(dataset_list))
         return dataset_list
 
-    def get_list_of_workflows_with_changed_datasets(self):
+    def get_updated_dataset_list_from_dbs(self, since_timestamp=0):
+        """
+        Get list of dataset names that changed since last update.
+        """
+        dataset_list = self.get_updated_datasets_from_dbs(since_timestamp)
+        return [dataset['dataset'] for dataset in dataset_list]
+
+    def get_last_dataset_modification_date(self):
+        """
+        Get timestamp since when datasets should be checked for changes
+        """
+        return max(0, self.database.get_setting('last_dbs_update_date', 0) - 300) # 300s margin
+
+    def revalidate_persistent_dbs_cache(self):
+        """
+        Remove outdated entries from persistent DBS cache and start using it.
+        Datasets of workflows that are putting data to DBS might be missing from
+        list of modified datasets, so their entries are always removed.
+        Return list of dataset names that changed since last update and list
+        of workflows that are active in wmstats
+        """
+        since_timestamp = self.get_last_dataset_modification_date()
+        # List of modified datasets covers changes up to the moment it was requested
+        checked_timestamp = time.time()
+        dataset_list = self.get_updated_datasets_from_dbs(since_timestamp)
+        self.persistent_dbs_cache.revalidate(dataset_list, since_timestamp, checked_timestamp)
+        active_workflows = self.get_active_workflows_from_wmstats()
+        active_datasets = set()
+        chunk_size = self.database.PAGE_SIZE
+        for start in range(0, len(active_workflows), chunk_size):
+            chunk = active_workflows[start:start + chunk_size]
+            for workflow in self.database.get_workflows_by_name(chunk, fields=['OutputDatasets']):
+                active_datasets.update(workflow.get('OutputDatasets', []))
+
+        self.persistent_dbs_cache.invalidate(sorted(active_datasets))
+        self.persistent_dbs_cache_valid = True
+        return [dataset['dataset'] for dataset in dataset_list], active_workflows
+
+    def get_list_of_workflows_with_changed_datasets(self, updated_datasets=None, active_workflows=None):
         """
         Get list of workflows whose datasets changed since last update.
+        If list of changed dataset names or list of workflows that are active
+        in wmstats is not given, it is fetched from DBS or wmstats
         """
         self.logger.info('Will get list of changed datasets')
         workflows = set()
-        last_dataset_modification_date = max(0, self.database.get_setting('last_dbs_update_date', 0) - 300) # 300s margin
-        updated_datasets = self.get_updated_dataset_list_from_dbs(since_timestamp=last_dataset_modification_date)
+        if updated_datasets is None:
+            last_dataset_modification_date = self.get_last_dataset_modification_date()
+            updated_datasets = self.get_updated_dataset_list_from_dbs(since_timestamp=last_dataset_modification_date)
+
         self.logger.info('Will find if any of changed datasets belong to workflows in database')
-        for dataset in updated_datasets:
-            dataset_workflows = self.database.get_workflows_with_output_dataset(dataset, page_size=1000)
-            self.logger.info('%d workflows contain %s', len(dataset_workflows), dataset)
-            workflows.update(dataset_workflows)
+        dataset_workflows = self.database.get_workflows_with_output_datasets(updated_datasets)
+        self.logger.info('%d workflows contain %d changed datasets',
+                         len(dataset_workflows),
+                         len(updated_datasets))
+        workflows.update(dataset_workflows)
 
-        workflows_from_wmstats = self.get_active_workflows_from_wmstats()
-        workflows.update(set(workflows_from_wmstats))
+        if active_workflows is None:
+            active_workflows = self.get_active_workflows_from_wmstats()
+
+        workflows.update(set(active_workflows))
 
         self.logger.info('Found %d workflows for changed datasets', len(workflows))
         return workflows
@@ -857,19 +1420,21 @@ class StatsUpdate():
         """
         Remove workflow from list of failed workflows that should be updated during next update
         """
-        workflows = self.get_list_of_previously_crashed_workflows()
-        if workflow_name in set(workflows):
-            workflows = [x for x in workflows if x != workflow_name]
-            self.database.set_setting('failed_workflows', workflows)
+        with self.crashed_workflows_lock:
+            workflows = self.get_list_of_previously_crashed_workflows()
+            if workflow_name in set(workflows):
+                workflows = [x for x in workflows if x != workflow_name]
+                self.database.set_setting('failed_workflows', workflows)
 
     def add_to_list_of_crashed_workflows(self, workflow_name):
         """
         Add workflow to list of failed workflows that should be updated during next update
         """
-        workflows = self.get_list_of_previously_crashed_workflows()
-        if workflow_name not in set(workflows):
-            workflows.append(workflow_name)
-            self.database.set_setting('failed_workflows', workflows)
+        with self.crashed_workflows_lock:
+            workflows = self.get_list_of_previously_crashed_workflows()
+            if workflow_name not in set(workflows):
+                workflows.append(workflow_name)
+                self.database.set_setting('failed_workflows', workflows)
 
     def trigger_outside(self, workflow, trigger_prod=False, trigger_dev=False):
         """
@@ -937,7 +1502,7 @@ def main():
     logger = logging.getLogger('logger')
     parser = argparse.ArgumentParser(description='Stats2 update')
     parser.add_argument('--action',
-                        choices=['update', 'see'],
+                        choices=['update', 'daemon', 'see'],
                         required=True,
                         help='Action to be performed.')
     parser.add_argument('--name',
@@ -951,6 +1516,56 @@ def main():
                         required=False,
                         action='store_true',
                         help='Trigger development McM to update')
+    parser.add_argument('--workers',
+                        required=False,
+                        type=int,
+                        default=1,
+                        help='Number of workflows to update concurrently, default is 1')
+    parser.add_argument('--bulk-size',
+                        required=False,
+                        type=int,
+                        default=0,
+                        help='Write up to N workflows in one bulk request, default is 0 (disabled)')
+    parser.add_argument('--dbs-cache',
+                        required=False,
+                        help='Path to SQLite file with DBS cache that is kept between updates')
+    parser.add_argument('--dbs-cache-size',
+                        required=False,
+                        type=int,
+                        default=200000,
+                        help='Maximum number of entries in DBS cache file, default is 200000')
+    parser.add_argument('--dbs-requests',
+                        required=False,
+                        type=int,
+                        default=4,
+                        help='Number of concurrent DBS requests while prefetching datasets, default is 4')
+    parser.add_argument('--reqmgr-batch-size',
+                        required=False,
+                        type=int,
+                        default=0,
+                        help='Fetch changed workflows from ReqMgr2 in batches of N documents, '
+                             'default is 0 (one request per workflow)')
+    parser.add_argument('--reqmgr-changes-limit',
+                        required=False,
+                        type=int,
+                        default=0,
+                        help='Process and checkpoint ReqMgr2 changes in batches of N changes, '
+                             'default is 0 (all changes at once)')
+    parser.add_argument('--debounce',
+                        required=False,
+                        type=int,
+                        default=60,
+                        help='Daemon: seconds without changes before workflow is updated, default is 60')
+    parser.add_argument('--max-delay',
+                        required=False,
+                        type=int,
+                        default=None,
+                        help='Daemon: maximum seconds a changing workflow waits for update, default is 10 * debounce')
+    parser.add_argument('--dbs-interval',
+                        required=False,
+                        type=int,
+                        default=1800,
+                        help='Daemon: seconds between recalculations of changed datasets, default is 1800')
     args = vars(parser.parse_args())
     logger.info('Arguments %s', str(args))
 
@@ -958,14 +1573,44 @@ def main():
     name = args.get('name', None)
     trigger_prod = args.get('trigger_prod', False)
     trigger_dev = args.get('trigger_dev', False)
-
-    if action == 'update':
+    workers = args.get('workers', 1)
+    bulk_size = args.get('bulk_size', 0)
+    dbs_cache_path = args.get('dbs_cache')
+    dbs_cache_size = args.get('dbs_cache_size', 200000)
+    dbs_requests = args.get('dbs_requests', 4)
+    reqmgr_batch_size = args.get('reqmgr_batch_size', 0)
+    reqmgr_changes_limit = args.get('reqmgr_changes_limit', 0)
+    debounce = args.get('debounce', 60)
+    dbs_interval = args.get('dbs_interval', 1800)
+    max_delay = args.get('max_delay')
+
+    if action in ('update', 'daemon'):
         if not os.environ.get('STATS_DB_AUTH_HEADER'):
             logger.error('STATS_DB_AUTH_HEADER is missing')
             return
 
-        stats_update = StatsUpdate()
-        stats_update.perform_update(name, trigger_prod, trigger_dev)
+        stats_update = StatsUpdate(workers=workers,
+                                   bulk_size=bulk_size,
+                                   dbs_cache_path=dbs_cache_path,
+                                   dbs_cache_size=dbs_cache_size,
+                                   dbs_requests=dbs_requests,
+                                   reqmgr_batch_size=reqmgr_batch_size,
+                                   reqmgr_changes_limit=reqmgr_changes_limit)
+        try:
+            stats_update.database.ensure_indexes()
+        except (HTTPError, URLError) as ex:
+            logger.error('Could not create Mango indexes: %s', ex)
+
+        if action == 'update':
+            stats_update.perform_update(name, trigger_prod, trigger_dev)
+        else:
+            signal.signal(signal.SIGTERM, lambda *_: stats_update.stop_daemon())
+            signal.signal(signal.SIGINT, lambda *_: stats_update.stop_daemon())
+            stats_update.run_daemon(trigger_prod,
+                                    trigger_dev,
+                                    debounce=debounce,
+                                    dbs_interval=dbs_interval,
+                                    max_delay=max_delay)
     elif action == 'see':
         workflow = Database().get_workflow(name)
         print(json.dumps(workflow, indent=4))
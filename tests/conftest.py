@@ -0,0 +1,7 @@
+"""
+Make modules in the repository root importable by tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
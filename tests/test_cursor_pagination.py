@@ -0,0 +1,94 @@
+"""
+Tests of cursor tokens and cursor pagination of Database views
+"""
+import json
+from urllib.parse import parse_qs, urlparse
+import pytest
+from couchdb_database import Database
+
+
+class FakeViewDatabase(Database):
+    """
+    Database that answers view requests from a list of (key, id) rows
+    """
+
+    def __init__(self, rows):
+        super().__init__()
+        self.rows = rows
+
+    def make_request(self, url, data=None, method='GET', raw=False, idempotent=None):
+        params = {name: values[0] for name, values in parse_qs(urlparse(url).query).items()}
+        descending = params.get('descending') == 'true'
+        rows = sorted(self.rows, reverse=descending)
+        if 'startkey' in params:
+            start = (json.loads(params['startkey']), params.get('startkey_docid', ''))
+            if descending:
+                rows = [row for row in rows if row <= (start[0], start[1] or '￿')]
+            else:
+                rows = [row for row in rows if row >= start]
+
+        if 'endkey' in params:
+            end_key = json.loads(params['endkey'])
+            rows = [row for row in rows if row[0] == end_key]
+
+        rows = rows[int(params.get('skip', 0)):int(params['limit'])]
+        return {'rows': [{'key': key, 'id': doc_id} for key, doc_id in rows]}
+
+
+def test_cursor_round_trip():
+    row = {'key': ['a', 1], 'id': 'workflow_1'}
+    position = Database.decode_cursor(Database.encode_cursor(row, 'next'))
+    assert position == {'key': ['a', 1], 'id': 'workflow_1', 'direction': 'next'}
+    position = Database.decode_cursor(Database.encode_cursor(row, 'previous', inclusive=True))
+    assert position['direction'] == 'previous'
+    assert position['inclusive']
+
+
+def test_bookmark_cursor_round_trip():
+    position = Database.decode_cursor(Database.encode_bookmark_cursor('g1AAAA'))
+    assert position == {'bookmark': 'g1AAAA', 'direction': 'next'}
+
+
+@pytest.mark.parametrize('cursor', ['not base64!', 'bm90IGpzb24=', 'WzFd', 'eyJkaXJlY3Rpb24iOiJ1cCJ9'])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        Database.decode_cursor(cursor)
+
+
+def test_pages_follow_each_other():
+    database = FakeViewDatabase([('v', 'w%02d' % (i)) for i in range(7)])
+    names, next_cursor, previous_cursor = database.get_workflows_page('prepid', 'v', page_size=3)
+    assert names == ['w00', 'w01', 'w02']
+    assert previous_cursor is None
+    names, next_cursor, previous_cursor = database.get_workflows_page('prepid', 'v',
+                                                                      cursor=next_cursor,
+                                                                      page_size=3)
+    assert names == ['w03', 'w04', 'w05']
+    names, last_cursor, _ = database.get_workflows_page('prepid', 'v',
+                                                       cursor=next_cursor,
+                                                       page_size=3)
+    assert names == ['w06']
+    assert last_cursor is None
+    names, _, _ = database.get_workflows_page('prepid', 'v', cursor=previous_cursor, page_size=3)
+    assert names == ['w00', 'w01', 'w02']
+
+
+def test_deleted_cursor_row_does_not_drop_rows():
+    database = FakeViewDatabase([('v', 'w%02d' % (i)) for i in range(7)])
+    _, next_cursor, _ = database.get_workflows_page('prepid', 'v', page_size=3)
+    # First row of the next page and last row of the first page are deleted
+    database.rows.remove(('v', 'w03'))
+    names, _, previous_cursor = database.get_workflows_page('prepid', 'v',
+                                                            cursor=next_cursor,
+                                                            page_size=3)
+    assert names == ['w04', 'w05', 'w06']
+    database.rows.remove(('v', 'w04'))
+    names, _, _ = database.get_workflows_page('prepid', 'v', cursor=previous_cursor, page_size=3)
+    assert names == ['w00', 'w01', 'w02']
+
+
+def test_view_cursor_is_not_a_bookmark():
+    database = FakeViewDatabase([])
+    cursor = Database.encode_bookmark_cursor('g1AAAA')
+    with pytest.raises(ValueError):
+        database.get_workflows_page('prepid', 'v', cursor=cursor)
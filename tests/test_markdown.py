@@ -0,0 +1,34 @@
+"""
+Tests of markdown report that must match the former pandas to_markdown output
+"""
+import pytest
+
+main = pytest.importorskip('main', exc_type=ImportError)
+
+
+TWO_WORKFLOWS = [{'RequestName': 'wf_a', 'InputDataset': '/In/A/RAW', 'OutputDatasets': ['/Out/A/AOD', '/Out/A/MINIAOD']}, {'RequestName': 'wf_b', 'OutputDatasets': []}]
+TWO_WORKFLOWS_MARKDOWN = "\n".join([
+    '| RequestName                                                         | InputDataset                                                                                                        | OutputDatasets                                                                                                                  |',
+    '|:--------------------------------------------------------------------|:--------------------------------------------------------------------------------------------------------------------|:--------------------------------------------------------------------------------------------------------------------------------|',
+    '| [wf_a](https://cms-pdmv-prod.web.cern.ch/stats/?workflow_name=wf_a) | [/In/A/RAW](https://cmsweb.cern.ch/das/request?view=list&limit=50&instance=prod%2Fglobal&input=dataset%3D/In/A/RAW) | - [/Out/A/AOD](https://cmsweb.cern.ch/das/request?view=list&limit=50&instance=prod%2Fglobal&input=dataset%3D/Out/A/AOD)         |',
+    '|                                                                     |                                                                                                                     | - [/Out/A/MINIAOD](https://cmsweb.cern.ch/das/request?view=list&limit=50&instance=prod%2Fglobal&input=dataset%3D/Out/A/MINIAOD) |',
+    '| [wf_b](https://cms-pdmv-prod.web.cern.ch/stats/?workflow_name=wf_b) |                                                                                                                     |                                                                                                                                 |',
+])
+
+
+ONE_WORKFLOW = [{'RequestName': 'wf_c', 'InputDataset': '/In/C/RAW', 'OutputDatasets': ['/Out/C/NANO']}]
+ONE_WORKFLOW_MARKDOWN = "\n".join([
+    '| RequestName                                                         | InputDataset                                                                                                        | OutputDatasets                                                                                                            |',
+    '|:--------------------------------------------------------------------|:--------------------------------------------------------------------------------------------------------------------|:--------------------------------------------------------------------------------------------------------------------------|',
+    '| [wf_c](https://cms-pdmv-prod.web.cern.ch/stats/?workflow_name=wf_c) | [/In/C/RAW](https://cmsweb.cern.ch/das/request?view=list&limit=50&instance=prod%2Fglobal&input=dataset%3D/In/C/RAW) | - [/Out/C/NANO](https://cmsweb.cern.ch/das/request?view=list&limit=50&instance=prod%2Fglobal&input=dataset%3D/Out/C/NANO) |',
+])
+
+
+@pytest.mark.parametrize('workflows, expected', [(TWO_WORKFLOWS, TWO_WORKFLOWS_MARKDOWN),
+                                                 (ONE_WORKFLOW, ONE_WORKFLOW_MARKDOWN)])
+def test_markdown_matches_pandas_output(workflows, expected):
+    assert main.report_as_markdown(workflows) == expected
+
+
+def test_no_workflows():
+    assert main.report_as_markdown([]) == ''
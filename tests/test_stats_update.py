@@ -0,0 +1,43 @@
+"""
+Tests of StatsUpdate with a mocked database and DBS
+"""
+from unittest import mock
+import pytest
+import stats_update
+from stats_update import StatsUpdate
+
+
+@pytest.fixture
+def stats():
+    with mock.patch('stats_update.Database') as database_class:
+        database = database_class.return_value
+        database.PAGE_SIZE = 2
+        database.get_setting.return_value = []
+        datasets = {'wf_a': ['/A/B/AOD'], 'wf_b': ['/A/B/AOD', '/C/D/NANO'], 'wf_c': []}
+        database.get_workflows_by_name.side_effect = lambda names, fields: [
+            {'_id': name, 'OutputDatasets': datasets[name]} for name in names
+        ]
+        yield StatsUpdate()
+
+
+def test_recalculate_workflows_with_set(stats):
+    dataset_list = [{'dataset': '/A/B/AOD', 'dataset_access_type': 'VALID'},
+                    {'dataset': '/C/D/NANO', 'dataset_access_type': 'PRODUCTION'}]
+    recalculated = []
+    with mock.patch.object(stats_update, 'make_cmsweb_prod_request', return_value=dataset_list), \
+         mock.patch.object(stats, 'get_event_count_from_dbs', return_value=10), \
+         mock.patch.object(stats, 'get_dataset_size_from_dbs', return_value=20), \
+         mock.patch.object(stats, 'recalculate_one', side_effect=lambda name, *_: recalculated.append(name)):
+        stats.recalculate_workflows({'wf_c', 'wf_a', 'wf_b'})
+
+    assert sorted(recalculated) == ['wf_a', 'wf_b', 'wf_c']
+    # Workflows are fetched in chunks of PAGE_SIZE
+    fetched = [call.args[0] for call in stats.database.get_workflows_by_name.call_args_list]
+    assert fetched == [['wf_a', 'wf_b'], ['wf_c']]
+    assert stats.dataset_info_cache['/A/B/AOD'] == {'Type': 'VALID', 'Events': 10, 'Size': 20}
+    assert stats.dataset_info_cache['/C/D/NANO'] == {'Type': 'PRODUCTION', 'Events': 10, 'Size': 20}
+
+
+def test_recalculate_workflows_without_workflows(stats):
+    stats.recalculate_workflows(set())
+    stats.database.get_workflows_by_name.assert_not_called()
@@ -0,0 +1,62 @@
+"""
+Tests of ThreadSafeCache
+"""
+import threading
+import time
+import pytest
+from utils import ThreadSafeCache
+
+
+def test_value_is_computed_once_for_concurrent_requests():
+    cache = ThreadSafeCache()
+    calls = []
+    started = threading.Barrier(8)
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.05)
+        return 'value'
+
+    def worker(results):
+        started.wait()
+        results.append(cache.get_or_compute('key', compute))
+
+    results = []
+    threads = [threading.Thread(target=worker, args=(results,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == ['value'] * 8
+    assert cache['key'] == 'value'
+
+
+def test_failed_computation_is_not_cached():
+    cache = ThreadSafeCache()
+
+    def fail():
+        raise ValueError('failed')
+
+    with pytest.raises(ValueError):
+        cache.get_or_compute('key', fail)
+
+    assert 'key' not in cache
+    assert cache.get_or_compute('key', lambda: 'value') == 'value'
+
+
+def test_dictionary_operations():
+    cache = ThreadSafeCache()
+    cache['a'] = 1
+    cache['b'] = 2
+    assert len(cache) == 2
+    assert cache.get('a') == 1
+    assert cache.get('c', 3) == 3
+    assert cache.pop('a') == 1
+    assert cache.pop('a', 'missing') == 'missing'
+    cache.clear()
+    assert len(cache) == 0
+    with pytest.raises(KeyError):
+        cache['b']
@@ -0,0 +1,26 @@
+"""
+Tests of TTLCache
+"""
+from unittest import mock
+from utils import TTLCache
+
+
+def test_ttl_cache_expires_values():
+    cache = TTLCache(ttl=10)
+    with mock.patch('utils.time.time', return_value=100):
+        cache.set('key', 'value')
+        assert cache.get('key') == 'value'
+
+    with mock.patch('utils.time.time', return_value=111):
+        assert cache.get('key', 'expired') == 'expired'
+
+
+def test_ttl_cache_evicts_oldest_values():
+    cache = TTLCache(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.set('a', 3)
+    cache.set('c', 4)
+    assert cache.get('b') is None
+    assert cache.get('a') == 3
+    assert cache.get('c') == 4
@@ -0,0 +1,100 @@
+"""
+Tests of UpdateJobQueue
+"""
+import hashlib
+import json
+import threading
+import time
+from update_jobs import UpdateJobQueue
+
+
+class BlockingUpdate():
+    """
+    Update function that blocks updates of "busy" workflow until released
+    """
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.updated = []
+
+    def __call__(self, workflow_name):
+        if workflow_name == 'busy':
+            self.started.set()
+            self.release.wait(5)
+
+        self.updated.append(workflow_name)
+
+
+def wait_for_job(queue, job_id):
+    for _ in range(500):
+        job = queue.get(job_id)
+        if job['status'] in ('done', 'failed'):
+            return job
+
+        time.sleep(0.01)
+
+    raise AssertionError('Job %s did not finish' % (job_id))
+
+
+def test_requests_are_merged_into_queued_job():
+    update = BlockingUpdate()
+    queue = UpdateJobQueue(update, max_workers=1)
+    try:
+        busy_job = queue.submit('busy')
+        update.started.wait(5)
+        first_job = queue.submit('workflow')
+        second_job = queue.submit('workflow')
+        assert first_job['id'] == second_job['id']
+        assert second_job['requests'] == 2
+        assert queue.stats() == {'queued': 1, 'running': 1, 'done': 0, 'failed': 0}
+    finally:
+        update.release.set()
+
+    assert wait_for_job(queue, busy_job['id'])['status'] == 'done'
+    assert wait_for_job(queue, first_job['id'])['status'] == 'done'
+    assert update.updated == ['busy', 'workflow']
+
+
+def test_failed_update_is_reported():
+    def update(workflow_name):
+        raise ValueError('no such workflow %s' % (workflow_name))
+
+    queue = UpdateJobQueue(update)
+    job = wait_for_job(queue, queue.submit('workflow')['id'])
+    assert job['status'] == 'failed'
+    assert job['error'] == 'no such workflow workflow'
+    assert queue.get('unknown') is None
+
+
+def test_requests_are_merged_across_processes(tmp_path):
+    update = BlockingUpdate()
+    queue = UpdateJobQueue(update, max_workers=1, jobs_dir=str(tmp_path))
+    other_queue = UpdateJobQueue(update, max_workers=1, jobs_dir=str(tmp_path))
+    try:
+        busy_job = queue.submit('busy')
+        update.started.wait(5)
+        job = queue.submit('workflow')
+        other_job = other_queue.submit('workflow')
+        assert other_job['id'] == job['id']
+        assert other_queue.get(busy_job['id'])['status'] == 'running'
+    finally:
+        update.release.set()
+
+    assert wait_for_job(other_queue, job['id'])['status'] == 'done'
+    assert update.updated == ['busy', 'workflow']
+
+
+def test_job_of_stopped_process_is_reclaimed(tmp_path):
+    stale_job = {'id': 'stale', 'workflow_name': 'workflow', 'status': 'queued',
+                 'requests': 1, 'submitted': 0, 'started': None, 'finished': None, 'error': None}
+    (tmp_path / 'stale.json').write_text(json.dumps(stale_job))
+    name_hash = hashlib.sha1(b'workflow').hexdigest()
+    (tmp_path / ('queued-%s.id' % (name_hash))).write_text('stale')
+
+    update = BlockingUpdate()
+    queue = UpdateJobQueue(update, jobs_dir=str(tmp_path))
+    job = queue.submit('workflow')
+    assert job['id'] != 'stale'
+    assert wait_for_job(queue, job['id'])['status'] == 'done'
+    assert queue.get('stale')['status'] == 'failed'
@@ -0,0 +1,94 @@
+"""
+Tests of WorkflowWriteBatch with a mocked database
+"""
+from unittest import mock
+from urllib.error import HTTPError, URLError
+import pytest
+from couchdb_database import WorkflowWriteBatch
+
+
+def make_batch(database, max_size=10):
+    errors = []
+    batch = WorkflowWriteBatch(database,
+                               max_size=max_size,
+                               on_error=lambda doc_id, error, reason: errors.append(doc_id))
+    return batch, errors
+
+
+def test_successful_write_calls_callbacks():
+    database = mock.Mock()
+    database.bulk_docs.side_effect = lambda docs: [{'id': doc['_id'], 'rev': '2-x'} for doc in docs]
+    batch, errors = make_batch(database)
+    saved = []
+    batch.update_workflow({'_id': 'a'}, callback=saved.append)
+    batch.delete_workflow('b', rev='1-x')
+    assert len(batch) == 2
+    batch.flush()
+    assert len(batch) == 0
+    assert [workflow['_id'] for workflow in saved] == ['a']
+    assert saved[0]['_rev'] == '2-x'
+    assert not errors
+    documents = database.bulk_docs.call_args[0][0]
+    assert documents[1] == {'_id': 'b', '_rev': '1-x', '_deleted': True}
+    database.get_workflow_revisions.assert_not_called()
+
+
+def test_batch_is_flushed_when_full():
+    database = mock.Mock()
+    database.bulk_docs.side_effect = lambda docs: [{'id': doc['_id'], 'rev': '1-x'} for doc in docs]
+    batch, _ = make_batch(database, max_size=2)
+    batch.update_workflow({'_id': 'a'})
+    database.bulk_docs.assert_not_called()
+    batch.update_workflow({'_id': 'b'})
+    database.bulk_docs.assert_called_once()
+
+
+def test_document_errors_are_reported():
+    database = mock.Mock()
+    database.bulk_docs.return_value = [{'id': 'a', 'rev': '2-x'},
+                                       {'id': 'b', 'error': 'conflict', 'reason': 'Document update conflict.'}]
+    batch, errors = make_batch(database)
+    saved = []
+    batch.update_workflow({'_id': 'a'}, callback=saved.append)
+    batch.update_workflow({'_id': 'b'}, callback=saved.append)
+    batch.flush()
+    assert [workflow['_id'] for workflow in saved] == ['a']
+    assert errors == ['b']
+    assert batch.errors[0]['error'] == 'conflict'
+
+
+def test_deletion_of_missing_workflow_is_skipped():
+    database = mock.Mock()
+    database.get_workflow_revisions.return_value = {}
+    database.bulk_docs.return_value = []
+    batch, errors = make_batch(database)
+    batch.delete_workflow('a')
+    batch.flush()
+    database.get_workflow_revisions.assert_called_once_with(['a'])
+    database.bulk_docs.assert_called_once_with([])
+    assert not errors
+
+
+@pytest.mark.parametrize('error', [URLError('down'),
+                                   HTTPError('url', 500, 'Internal Server Error', None, None)])
+def test_failed_bulk_request_reports_every_document(error):
+    database = mock.Mock()
+    database.bulk_docs.side_effect = error
+    batch, errors = make_batch(database)
+    saved = []
+    batch.update_workflow({'_id': 'a'}, callback=saved.append)
+    batch.delete_workflow('b', rev='1-x')
+    batch.flush()
+    assert not saved
+    assert errors == ['a', 'b']
+
+
+def test_failed_revision_lookup_reports_every_document():
+    database = mock.Mock()
+    database.get_workflow_revisions.side_effect = URLError('down')
+    batch, errors = make_batch(database)
+    batch.update_workflow({'_id': 'a'})
+    batch.delete_workflow('b')
+    batch.flush()
+    database.bulk_docs.assert_not_called()
+    assert errors == ['a', 'b']
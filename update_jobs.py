@@ -0,0 +1,349 @@
+"""
+Module that contains UpdateJobQueue class
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class UpdateJobQueue():
+    """
+    Queue of single workflow update jobs that are run by a pool of worker threads
+    Requests to update a workflow that already has a queued job are merged into
+    that job. If workflow is being updated, one more job is queued, so changes
+    made after the running update started are not missed
+    If jobs_dir is given, jobs are also saved there, so all processes of a
+    multi-process server share them: status of jobs can be read by any process,
+    requests are merged with a job queued by another process and at most
+    max_workers jobs of all processes run at the same time
+    """
+
+    def __init__(self, update_function, max_workers=2, job_ttl=3600, jobs_dir=None):
+        self.logger = logging.getLogger('logger')
+        # Function that is called with workflow name
+        self.update_function = update_function
+        # Finished jobs are kept for this many seconds
+        self.job_ttl = job_ttl
+        self.jobs_dir = jobs_dir
+        if jobs_dir:
+            os.makedirs(jobs_dir, exist_ok=True)
+
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        # Job id -> job dictionary
+        self.jobs = {}
+        # Workflow name -> id of job that is queued, but not started yet
+        self.queued_jobs = {}
+        # Workflow name -> locked queued mark file of a job of this process
+        self.queued_files = {}
+
+    def submit(self, workflow_name):
+        """
+        Queue update of a workflow and return the job dictionary
+        """
+        with self.lock:
+            self.__remove_old_jobs()
+            job_id = self.queued_jobs.get(workflow_name)
+            if job_id is not None:
+                job = self.jobs[job_id]
+                job['requests'] += 1
+                return dict(job)
+
+            job = {'id': uuid.uuid4().hex,
+                   'workflow_name': workflow_name,
+                   'status': 'queued',
+                   'requests': 1,
+                   'submitted': int(time.time()),
+                   'started': None,
+                   'finished': None,
+                   'error': None}
+            # Job file must exist before other processes can see it as queued
+            self.__save(job)
+            other_job = self.__claim_queued(workflow_name, job['id'])
+            if other_job is not None:
+                self.__remove_file(job['id'])
+                return other_job
+
+            self.jobs[job['id']] = job
+            self.queued_jobs[workflow_name] = job['id']
+
+        self.logger.info('Queued update job %s of %s', job['id'], workflow_name)
+        self.executor.submit(self.__run, job)
+        return dict(job)
+
+    def get(self, job_id):
+        """
+        Return a copy of job dictionary or None if there is no such job
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job:
+                return dict(job)
+
+        # Job might have been submitted to another process
+        return self.__load(job_id)
+
+    def stats(self):
+        """
+        Return number of jobs in each status
+        """
+        with self.lock:
+            counts = {'queued': 0, 'running': 0, 'done': 0, 'failed': 0}
+            for job in self.jobs.values():
+                counts[job['status']] += 1
+
+            return counts
+
+    def __run(self, job):
+        """
+        Run update of job's workflow and store the result in the job
+        """
+        workflow_name = job['workflow_name']
+        slot_file = self.__acquire_slot()
+        with self.lock:
+            self.queued_jobs.pop(workflow_name, None)
+            self.__release_queued(workflow_name)
+            job['status'] = 'running'
+            job['started'] = int(time.time())
+            self.__save(job)
+
+        try:
+            self.update_function(workflow_name)
+            status, error = 'done', None
+        except Exception as ex:
+            self.logger.error('Update job %s of %s failed: %s', job['id'], workflow_name, ex)
+            status, error = 'failed', str(ex)
+        finally:
+            if slot_file is not None:
+                # Closing the file releases the lock
+                slot_file.close()
+
+        with self.lock:
+            job['status'] = status
+            job['error'] = error
+            job['finished'] = int(time.time())
+            self.__save(job)
+
+        self.logger.info('Update job %s of %s finished in %ss: %s',
+                         job['id'],
+                         workflow_name,
+                         job['finished'] - job['started'],
+                         status)
+
+    def __remove_old_jobs(self):
+        """
+        Forget jobs that finished more than job_ttl seconds ago, lock must be held
+        """
+        now = time.time()
+        old_jobs = [job_id for job_id, job in self.jobs.items()
+                    if job['finished'] and now - job['finished'] > self.job_ttl]
+        for job_id in old_jobs:
+            del self.jobs[job_id]
+
+        if not self.jobs_dir:
+            return
+
+        # Files of all processes
+        for file_name in os.listdir(self.jobs_dir):
+            if file_name.endswith('.lock'):
+                continue
+
+            file_path = os.path.join(self.jobs_dir, file_name)
+            if file_name.startswith('queued-') and file_name.endswith('.id'):
+                # Marks of queued jobs are removed only if their owner stopped
+                self.__reclaim_queued(file_path)
+                continue
+
+            try:
+                if now - os.path.getmtime(file_path) > self.job_ttl:
+                    os.remove(file_path)
+            except OSError:
+                pass
+
+    def __load(self, job_id):
+        """
+        Read job from a file in jobs_dir or return None if there is no such job
+        """
+        if not self.jobs_dir or not job_id.isalnum():
+            return None
+
+        try:
+            with open(os.path.join(self.jobs_dir, job_id + '.json')) as job_file:
+                return json.load(job_file)
+        except (OSError, ValueError):
+            return None
+
+    def __remove_file(self, job_id):
+        """
+        Remove file of a job that was not queued, lock must be held
+        """
+        try:
+            os.remove(os.path.join(self.jobs_dir, job_id + '.json'))
+        except OSError:
+            pass
+
+    def __save(self, job):
+        """
+        Write job to a file in jobs_dir, lock must be held
+        """
+        if not self.jobs_dir:
+            return
+
+        file_path = os.path.join(self.jobs_dir, job['id'] + '.json')
+        try:
+            with open(file_path + '.tmp', 'w') as job_file:
+                json.dump(job, job_file)
+
+            os.replace(file_path + '.tmp', file_path)
+        except OSError as ex:
+            self.logger.error('Could not save update job %s: %s', job['id'], ex)
+
+    def __get_queued_path(self, workflow_name):
+        """
+        Return path of file with id of workflow's queued job
+        """
+        name_hash = hashlib.sha1(workflow_name.encode('utf-8')).hexdigest()
+        return os.path.join(self.jobs_dir, 'queued-%s.id' % (name_hash))
+
+    def __claim_queued(self, workflow_name, job_id):
+        """
+        Mark job_id as queued job of the workflow in jobs_dir, so other
+        processes merge their requests into it. If another process already
+        has a queued job of the workflow, return that job, lock must be held
+        Mark is written to a temporary file and linked into place, so it is
+        never seen without job id. It stays locked while job is queued, so
+        marks of processes that stopped can be told apart and reclaimed
+        """
+        if not self.jobs_dir:
+            return None
+
+        file_path = self.__get_queued_path(workflow_name)
+        temp_path = '%s.%s.tmp' % (file_path, job_id)
+        try:
+            queued_file = open(temp_path, 'w')
+            fcntl.flock(queued_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            queued_file.write(job_id)
+            queued_file.flush()
+        except OSError as ex:
+            self.logger.error('Could not mark %s as queued: %s', workflow_name, ex)
+            return None
+
+        try:
+            for _ in range(3):
+                try:
+                    os.link(temp_path, file_path)
+                    self.queued_files[workflow_name] = queued_file
+                    queued_file = None
+                    return None
+                except FileExistsError:
+                    pass
+
+                if self.__reclaim_queued(file_path):
+                    continue
+
+                try:
+                    with open(file_path) as id_file:
+                        other_job = self.__load(id_file.read().strip())
+                except OSError:
+                    # Removed by the owner in the meantime
+                    continue
+
+                if other_job is not None:
+                    return other_job
+
+            self.logger.error('Could not mark %s as queued', workflow_name)
+            return None
+        except OSError as ex:
+            self.logger.error('Could not mark %s as queued: %s', workflow_name, ex)
+            return None
+        finally:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+            if queued_file is not None:
+                queued_file.close()
+
+    def __reclaim_queued(self, file_path):
+        """
+        Remove queued mark if process that owns it stopped and mark its job
+        as failed. Return whether mark was removed
+        """
+        try:
+            with open(file_path) as id_file:
+                try:
+                    fcntl.flock(id_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    # Owner is alive
+                    return False
+
+                # Mark might have been replaced after it was opened
+                if os.fstat(id_file.fileno()).st_ino != os.stat(file_path).st_ino:
+                    return True
+
+                job_id = id_file.read().strip()
+                os.remove(file_path)
+        except OSError:
+            return True
+
+        job = self.__load(job_id)
+        if job is not None and job['status'] == 'queued':
+            self.logger.warning('Update job %s of %s was left queued by a stopped process',
+                                job_id,
+                                job['workflow_name'])
+            job['status'] = 'failed'
+            job['error'] = 'Process that queued the job stopped'
+            job['finished'] = int(time.time())
+            self.__save(job)
+
+        return True
+
+    def __release_queued(self, workflow_name):
+        """
+        Remove queued mark of the workflow that belongs to this process, lock
+        must be held
+        """
+        queued_file = self.queued_files.pop(workflow_name, None)
+        if queued_file is None:
+            return
+
+        try:
+            os.remove(self.__get_queued_path(workflow_name))
+        except OSError:
+            pass
+        finally:
+            queued_file.close()
+
+    def __acquire_slot(self):
+        """
+        Wait until one of max_workers slot lock files in jobs_dir is free and
+        return the locked file. Locks are released by the system if a process
+        stops, so slots are never lost
+        """
+        if not self.jobs_dir:
+            return None
+
+        while True:
+            for slot in range(self.max_workers):
+                file_path = os.path.join(self.jobs_dir, 'slot-%s.lock' % (slot))
+                try:
+                    slot_file = open(file_path, 'a')
+                except OSError as ex:
+                    self.logger.error('Could not open update slot %s: %s', file_path, ex)
+                    return None
+
+                try:
+                    fcntl.flock(slot_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return slot_file
+                except OSError:
+                    slot_file.close()
+
+            time.sleep(1)
@@ -0,0 +1,78 @@
+"""
+This module has the loop shared by modules that scan all
+the workflows available in Stats2 request database and
+include a new attribute into them
+"""
+
+import os
+import datetime
+from typing import Callable
+from couchdb_database import Database
+
+
+def check_required_variables(required_variables: list[str]) -> None:
+    """
+    Check the required environment variables are set
+    before starting the execution
+
+    Args:
+        required_variables (list[str]): Names of environment variables.
+
+    Raises:
+        RuntimeError: If any of the variables is not set.
+    """
+    missing_variables = [env for env in required_variables if not os.getenv(env)]
+    if missing_variables:
+        raise RuntimeError(f"Please set the following env variables: {missing_variables}")
+
+
+def backfill_all_workflows(
+    database: Database,
+    update_request: Callable[[dict], tuple[dict, bool]],
+    page_size: int = 500,
+) -> None:
+    """
+    Scan all the workflows page by page, call update_request
+    for each of them and write the updated ones in bulk
+
+    Args:
+        database (Database): Stats2 database.
+        update_request (Callable): Function that takes a Stats2 request
+            and returns the request and True if it was updated.
+        page_size (int): Number of documents fetched at once.
+    """
+    logger = database.logger
+    start_time = datetime.datetime.now()
+    updated_count: int = 0
+    scanned_count: int = 0
+    cursor: str | None = None
+    with database.write_batch() as write_batch:
+        while True:
+            stats_reqs, cursor, _ = database.get_workflows_page(
+                filter_name=None,
+                value=None,
+                cursor=cursor,
+                page_size=page_size,
+                include_docs=True,
+            )
+            for stats_req in stats_reqs:
+                scanned_count += 1
+                if stats_req["_id"].startswith("_design"):
+                    continue
+
+                request, updated = update_request(stats_req)
+                if updated:
+                    # Keep the original 'LastUpdate' value
+                    write_batch.update_workflow(request, update_timestamp=False)
+                    updated_count += 1
+
+            logger.info("Scanned %s documents, updated %s", scanned_count, updated_count)
+            if not cursor:
+                break
+
+    end_time = datetime.datetime.now()
+    if write_batch.errors:
+        logger.error("Unable to store %s documents", len(write_batch.errors))
+
+    logger.info("Updated documents (%s)", updated_count)
+    logger.info("Elapsed time: %s", end_time - start_time)
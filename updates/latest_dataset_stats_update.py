@@ -0,0 +1,51 @@
+"""
+This module scans all the workflows available in Stats2
+request database and includes the 'LatestDatasetStats'
+attribute computed from their 'EventNumberHistory'
+"""
+
+from couchdb_database import Database
+from backfill import backfill_all_workflows, check_required_variables
+from utils import get_latest_dataset_stats, setup_console_logging
+
+# Set up the logger
+setup_console_logging()
+
+# Check the required variables are set before starting the execution
+check_required_variables(["DB_URL", "STATS_DB_AUTH_HEADER"])
+
+# Start the execution
+database: Database = Database()
+
+
+def include_latest_dataset_stats(stats_req: dict) -> tuple[dict, bool]:
+    """
+    Compute the latest dataset statistics for the given
+    Stats2 request and include them into the document.
+
+    Args:
+        stats_req (dict): Stats2 request data
+
+    Returns
+        dict: Stats2 request with latest dataset statistics included.
+        bool: True if the request was updated.
+    """
+    latest_stats: dict = get_latest_dataset_stats(stats_req)
+    if stats_req.get("LatestDatasetStats") == latest_stats:
+        return stats_req, False
+
+    request = dict(stats_req)
+    request["LatestDatasetStats"] = latest_stats
+    return request, True
+
+
+def execute(page_size: int = 500) -> None:
+    """
+    Execute all the operations to include the latest
+    dataset statistics into all the workflows
+    """
+    backfill_all_workflows(database, include_latest_dataset_stats, page_size)
+
+
+if __name__ == "__main__":
+    execute()
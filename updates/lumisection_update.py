@@ -9,7 +9,7 @@ import pprint
 import datetime
 from copy import deepcopy
 from stats_update import StatsUpdate
-from utils import make_request, setup_console_logging
+from utils import make_request, setup_console_logging, get_latest_dataset_stats
 
 # Set up the logger
 setup_console_logging()
@@ -155,6 +155,7 @@ def include_lumisections(stats_req: dict) -> tuple[dict, bool]:
 
             # Update the history
             request[history] = history_updated
+            request["LatestDatasetStats"] = get_latest_dataset_stats(request)
             updated = True
 
     return request, updated
@@ -172,20 +173,24 @@ def execute() -> None:
 
     # Lumisections included
     rereco_lumisections = []
-    for idx, stats_req in enumerate(rereco_workflows):
-        logger.info(
-            "%s/%s Updating Stats2 request (%s)",
-            idx + 1,
-            len(rereco_workflows),
-            stats_req.get("_id"),
-        )
-        request, updated = include_lumisections(stats_req)
-        if updated:
-            logger.info("Storing update into database")
-            stats_handler.database.update_workflow(request)
-            rereco_lumisections.append(request)
-        else:
-            logger.warning("It wasn't required to include lumisections, skipping")
+    with stats_handler.database.write_batch() as write_batch:
+        for idx, stats_req in enumerate(rereco_workflows):
+            logger.info(
+                "%s/%s Updating Stats2 request (%s)",
+                idx + 1,
+                len(rereco_workflows),
+                stats_req.get("_id"),
+            )
+            request, updated = include_lumisections(stats_req)
+            if updated:
+                logger.info("Storing update into database")
+                write_batch.update_workflow(request)
+                rereco_lumisections.append(request)
+            else:
+                logger.warning("It wasn't required to include lumisections, skipping")
+
+    if write_batch.errors:
+        logger.error("Unable to store %s documents", len(write_batch.errors))
 
     end_time = datetime.datetime.now()
 
@@ -0,0 +1,51 @@
+"""
+This module scans all the workflows available in Stats2
+request database and includes the 'RequestStatus'
+attribute - status of the last 'RequestTransition'
+"""
+
+from couchdb_database import Database
+from backfill import backfill_all_workflows, check_required_variables
+from utils import setup_console_logging
+
+# Set up the logger
+setup_console_logging()
+
+# Check the required variables are set before starting the execution
+check_required_variables(["DB_URL", "STATS_DB_AUTH_HEADER"])
+
+# Start the execution
+database: Database = Database()
+
+
+def include_request_status(stats_req: dict) -> tuple[dict, bool]:
+    """
+    Include the status of the last transition into the
+    given Stats2 request.
+
+    Args:
+        stats_req (dict): Stats2 request data
+
+    Returns
+        dict: Stats2 request with request status included.
+        bool: True if the request was updated.
+    """
+    transitions: list[dict] = stats_req.get("RequestTransition", [])
+    if not transitions or stats_req.get("RequestStatus") == transitions[-1]["Status"]:
+        return stats_req, False
+
+    request = dict(stats_req)
+    request["RequestStatus"] = transitions[-1]["Status"]
+    return request, True
+
+
+def execute(page_size: int = 500) -> None:
+    """
+    Execute all the operations to include the request
+    status into all the workflows
+    """
+    backfill_all_workflows(database, include_request_status, page_size)
+
+
+if __name__ == "__main__":
+    execute()
@@ -7,11 +7,14 @@ import time
 import os
 import datetime
 import hashlib
+import threading
+from collections import OrderedDict
 import urllib.parse
 from connection_wrapper import ConnectionWrapper
 
 
 __CONNECTION_WRAPPERS = {}
+__CONNECTION_WRAPPERS_LOCK = threading.Lock()
 __ACCESS_TOKENS: dict[str, tuple[datetime.timedelta, datetime.datetime, str]] = {}
 
 
@@ -47,11 +50,12 @@ def make_request(
     and add necessary grid certificates for authentication
     """
     connection_wrapper_key = f"{host}___{timeout}___{keep_open}"
-    connection_wrapper = __CONNECTION_WRAPPERS.get(connection_wrapper_key)
-    if connection_wrapper is None:
-        connection_wrapper = ConnectionWrapper(host, keep_open=keep_open)
-        connection_wrapper.timeout = timeout
-        __CONNECTION_WRAPPERS[connection_wrapper_key] = connection_wrapper
+    with __CONNECTION_WRAPPERS_LOCK:
+        connection_wrapper = __CONNECTION_WRAPPERS.get(connection_wrapper_key)
+        if connection_wrapper is None:
+            connection_wrapper = ConnectionWrapper(host, keep_open=keep_open)
+            connection_wrapper.timeout = timeout
+            __CONNECTION_WRAPPERS[connection_wrapper_key] = connection_wrapper
 
     method = "GET" if data is None else "POST"
     logger = logging.getLogger("logger")
@@ -270,7 +274,159 @@ def comma_separate_thousands(number):
     return "{:,}".format(int(number))
 
 
+def get_latest_dataset_stats(workflow):
+    """
+    Return a dictionary of output datasets and their latest type, events, size,
+    lumisections (if available) and completion based on workflow's event history
+    """
+    total_events = workflow.get('TotalEvents', 0) or 0
+    total_lumis = workflow.get('TotalInputLumis', 0) or 0
+    history_entries = sorted(workflow.get('EventNumberHistory', []),
+                             key=lambda entry: entry.get('Time', 0),
+                             reverse=True)
+    latest_stats = {}
+    for dataset in workflow.get('OutputDatasets', []):
+        for history_entry in history_entries:
+            dataset_entry = history_entry.get('Datasets', {}).get(dataset)
+            if dataset_entry is None:
+                continue
+
+            events = dataset_entry.get('Events', 0)
+            stats = {'Type': dataset_entry.get('Type', 'NONE'),
+                     'Events': events,
+                     'Size': dataset_entry.get('Size', -1),
+                     'Time': history_entry.get('Time', 0),
+                     'Completion': 0.0}
+            if total_events > 0:
+                stats['Completion'] = round(events / total_events * 100.0, 2)
+
+            lumis = dataset_entry.get('Lumis')
+            if lumis is not None:
+                stats['Lumis'] = lumis
+                if total_lumis > 0:
+                    stats['LumiCompletion'] = round(lumis / total_lumis * 100.0, 2)
+
+            latest_stats[dataset] = stats
+            break
+
+    return latest_stats
+
+
 def hash_object(obj) -> str:
     # Convert object to a canonical JSON string to ensure stable representation
     obj_str = json.dumps(obj, sort_keys=True, separators=(',', ':'))
     return hashlib.sha256(obj_str.encode('utf-8')).hexdigest()
+
+
+class ThreadSafeCache():
+    """
+    Dictionary-like cache that can be shared between threads.
+    Value of a key is computed only once even if it is requested
+    by multiple threads at the same time
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__key_locks = {}
+        self.__values = {}
+
+    def __contains__(self, key):
+        with self.__lock:
+            return key in self.__values
+
+    def __getitem__(self, key):
+        with self.__lock:
+            return self.__values[key]
+
+    def __setitem__(self, key, value):
+        with self.__lock:
+            self.__values[key] = value
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__values)
+
+    def pop(self, key, default=None):
+        """
+        Remove key from cache and return its value or default if key is not in cache
+        """
+        with self.__lock:
+            return self.__values.pop(key, default)
+
+    def clear(self):
+        """
+        Remove all values from cache
+        """
+        with self.__lock:
+            self.__values.clear()
+
+    def get(self, key, default=None):
+        """
+        Return cached value or default if key is not in cache
+        """
+        with self.__lock:
+            return self.__values.get(key, default)
+
+    def get_or_compute(self, key, compute):
+        """
+        Return cached value or call compute() to get it, store it and return it
+        """
+        with self.__lock:
+            if key in self.__values:
+                return self.__values[key]
+
+            key_lock = self.__key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self.__lock:
+                if key in self.__values:
+                    return self.__values[key]
+
+            try:
+                value = compute()
+                with self.__lock:
+                    self.__values[key] = value
+            finally:
+                with self.__lock:
+                    self.__key_locks.pop(key, None)
+
+        return value
+
+
+class TTLCache():
+    """
+    Thread-safe cache of at most max_entries values that expire after ttl seconds
+    """
+
+    def __init__(self, max_entries=1000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.__lock = threading.Lock()
+        # Key -> (time when it was stored, value)
+        self.__values = OrderedDict()
+
+    def get(self, key, default=None):
+        """
+        Return cached value or default if key is not in cache or expired
+        """
+        with self.__lock:
+            entry = self.__values.get(key)
+            if entry is None:
+                return default
+
+            stored, value = entry
+            if time.time() - stored > self.ttl:
+                del self.__values[key]
+                return default
+
+            return value
+
+    def set(self, key, value):
+        """
+        Store value in cache and remove oldest values if there are too many
+        """
+        with self.__lock:
+            self.__values.pop(key, None)
+            self.__values[key] = (time.time(), value)
+            while len(self.__values) > self.max_entries:
+                self.__values.popitem(last=False)